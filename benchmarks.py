@@ -0,0 +1,303 @@
+import argparse
+import json
+import platform
+import time
+import tracemalloc
+
+from building import Building
+from elevator import Elevator, ElevatorEvent
+from explorer import Explorer
+
+# Building heights the exploration is timed at
+FLOOR_SWEEP = (5, 10, 20, 30, 40)
+# Metrics that get worse when they go up. Everything else is a rate, which
+# gets worse when it goes down
+_LOWER_IS_BETTER = ("seconds", "bytes")
+# Every timing is taken over at least this long, and durations shorter than
+# this are too noisy to compare against a baseline
+MIN_SECONDS = 0.2
+
+
+def _busy_elevator() -> Elevator:
+    elevator = Elevator()
+    elevator.handle_event(
+        ElevatorEvent(kind="ONBOARD_PANEL_BUTTON_PRESS", payload={"dest": 5})
+    )
+    elevator.handle_event(
+        ElevatorEvent(
+            kind="HALLWAY_BUTTON_PRESS", payload={"floor": 3, "direction": "DOWN"}
+        )
+    )
+    return elevator
+
+
+def _measure(step, elevator: Elevator, events: list, rounds: int) -> dict:
+    def visit_all():
+        for event in events:
+            step(elevator, event)
+
+    # Timed without tracemalloc, which slows everything down
+    seconds = _best_time(visit_all)
+    tracemalloc.start()
+    for _ in range(rounds):
+        visit_all()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "steps": len(events),
+        "steps_per_second": len(events) / seconds,
+        "peak_bytes": peak,
+    }
+
+
+def _copy_step(elevator: Elevator, event: ElevatorEvent):
+    new_elevator = elevator.copy()
+    new_elevator.handle_event(event)
+    new_elevator.to_code()
+
+
+def _undo_step(elevator: Elevator, event: ElevatorEvent):
+    elevator.handle_event(event, record=True)
+    elevator.to_code()
+    elevator.revert()
+
+
+def bench_copy_vs_undo(rounds: int = 2000) -> dict:
+    """Visit every edge out of one state, copying vs apply/revert
+
+    The peak memory is that of `rounds` visits.
+    """
+    elevator = _busy_elevator()
+    events = elevator.building.possible_events(elevator.state)
+    return {
+        "copy": _measure(_copy_step, elevator, events, rounds),
+        "undo": _measure(_undo_step, elevator, events, rounds),
+    }
+
+
+def _best_time(step, repeat: int = 7) -> float:
+    """Seconds per call of `step`, from the fastest of `repeat` runs
+
+    Each run calls `step` as many times as it takes to last MIN_SECONDS,
+    like `timeit.Timer.autorange()`, so short steps are timed over many calls.
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            step()
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_SECONDS:
+            break
+        number *= 2
+    best = elapsed
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            step()
+        best = min(best, time.perf_counter() - start)
+    return best / number
+
+
+def _best_rate(step, repeat: int = 7) -> float:
+    """Calls of `step` per second, from the fastest of `repeat` runs"""
+    return 1 / _best_time(step, repeat)
+
+
+def _bytes_per_call(make, number: int = 2000) -> float:
+    """Memory still held by what `make` returns, per call"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [make() for _ in range(number)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return (after - before) / number
+
+
+def _elevators_by_mode() -> dict[str, Elevator]:
+    moving = _busy_elevator()
+    loading = Elevator()
+    loading.handle_event(
+        ElevatorEvent(kind="ONBOARD_PANEL_BUTTON_PRESS", payload={"dest": 2})
+    )
+    loading.handle_event(
+        ElevatorEvent(kind="ONBOARD_PANEL_BUTTON_PRESS", payload={"dest": 4})
+    )
+    loading.handle_event(ElevatorEvent(kind="FLOOR_SENSOR", payload={"floor": 2}))
+    return {"IDLE": Elevator(), "MOVING": moving, "LOADING": loading}
+
+
+def bench_handle_event() -> dict:
+    """Events per second handled in each mode, over every possible event
+
+    Each event is handled with `record=True` and reverted, so the elevator
+    stays in the mode being measured.
+    """
+    results = {}
+    for mode, elevator in _elevators_by_mode().items():
+        events = elevator.building.possible_events(elevator.state)
+
+        def step():
+            for event in events:
+                elevator.handle_event(event, record=True)
+                elevator.revert()
+
+        results[mode] = {
+            "events": len(events),
+            "events_per_second": _best_rate(step) * len(events),
+        }
+    return results
+
+
+def bench_elevator() -> dict:
+    elevator = _busy_elevator()
+    return {
+        "copy": {
+            "calls_per_second": _best_rate(elevator.copy),
+            "allocated_bytes": _bytes_per_call(elevator.copy),
+        },
+        "invariants": {"calls_per_second": _best_rate(elevator.invariants)},
+        "to_code": {"calls_per_second": _best_rate(elevator.to_code)},
+    }
+
+
+def bench_possible_events() -> dict:
+    """Building.possible_events, from its tables and from scratch"""
+    state = _busy_elevator().state
+    possible_events = state.building.possible_events
+    args = (state.mode, state.direction, state.current_floor)
+
+    def build():
+        return state.building.events_for(*args)
+
+    return {
+        "cached_calls_per_second": _best_rate(lambda: possible_events(state)),
+        "uncached_calls_per_second": _best_rate(build),
+        "uncached_allocated_bytes": _bytes_per_call(build),
+    }
+
+
+def _explore(building: Building, full_state: bool) -> Explorer:
+    explorer = Explorer(
+        building.possible_events, full_state=full_state, stop_on_violation=False
+    )
+    explorer.explore(Elevator(building=building))
+    return explorer
+
+
+def bench_exploration(sweep=FLOOR_SWEEP, full_state_up_to: int = 5) -> dict:
+    """Exploration time and peak memory for buildings of different heights
+
+    Every building is explored by (mode, direction, floor) like testing.py
+    does, and the ones with up to `full_state_up_to` floors by full state as
+    well. Above that the full state space is too big to finish. The time is
+    that of one exploration, from the fastest of a few runs of MIN_SECONDS
+    or more each.
+    """
+    results = {}
+    for n_floors in sweep:
+        building = Building(bottom_floor=1, top_floor=n_floors)
+        for full_state in (False, True):
+            if full_state and n_floors > full_state_up_to:
+                continue
+            explorer = _explore(building, full_state)
+            # Full state explorations take seconds, don't repeat them as often
+            repeat = 3 if full_state else 7
+            seconds = _best_time(lambda: _explore(building, full_state), repeat)
+            # Time and memory in separate runs, tracemalloc slows it down
+            tracemalloc.start()
+            _explore(building, full_state)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            key = f"{n_floors}_floors" + ("_full_state" if full_state else "")
+            results[key] = {
+                "states": explorer.stats.states,
+                "edges": explorer.stats.edges,
+                "seconds": seconds,
+                # The same, as a rate timed over MIN_SECONDS or more, so that
+                # compare() checks it however short one exploration is
+                "explorations_per_second": 1 / seconds,
+                "peak_bytes": peak,
+            }
+    return results
+
+
+def run_all(copy_vs_undo_rounds: int = 2000) -> dict:
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+        },
+        "handle_event": bench_handle_event(),
+        "elevator": bench_elevator(),
+        "get_possible_events": bench_possible_events(),
+        "copy_vs_undo": bench_copy_vs_undo(copy_vs_undo_rounds),
+        "exploration": bench_exploration(),
+    }
+
+
+def _flatten(results: dict, prefix: str = "") -> dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(results: dict, baseline: dict, tolerance: float = 0.1) -> list[str]:
+    """One line per metric that got more than `tolerance` worse than baseline
+
+    Counts (states, edges...) should never change between runs of the same
+    code, so any change in those is reported too. Durations under MIN_SECONDS
+    are left out, they are mostly noise (the rates are all timed over longer).
+    """
+    current, previous = _flatten(results), _flatten(baseline)
+    regressions = []
+    for name, old in sorted(previous.items()):
+        if name not in current or name.startswith("meta.") or not old:
+            continue
+        new = current[name]
+        change = (new - old) / old
+        if name.endswith("seconds") and max(old, new) < MIN_SECONDS:
+            continue
+        if name.endswith(_LOWER_IS_BETTER):
+            worse = change > tolerance
+        elif name.endswith("per_second"):
+            worse = -change > tolerance
+        else:
+            worse = new != old
+        if worse:
+            regressions.append(f"{name}: {old:.6g} -> {new:.6g} ({change:+.1%})")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the elevator controller")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against this results file")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="How much worse than the baseline a metric may get (default 0.1)",
+    )
+    args = parser.parse_args()
+
+    results = run_all()
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        raise SystemExit(1 if regressions else 0)
@@ -0,0 +1,161 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from itertools import product
+
+from events import Event, EventKind
+
+# Directions a hallway button can ask for, in the order their events are listed
+BUTTON_DIRECTIONS = ("UP", "DOWN")
+
+
+@dataclass(frozen=True)
+class Building:
+    """The floors an elevator runs between, and the ones it stops at
+
+    `unserved` floors have no buttons and the car never stops there. Nor does
+    it strictly inside any of the `express_zones`, (low, high) pairs of floors
+    it runs nonstop between. The floor sensors still fire on every floor.
+
+    Everything that only depends on the building, like the hallway buttons
+    there are or the events that can happen in each (mode, direction, floor),
+    is worked out once when the Building is created. Make one per building
+    and share it between its elevators.
+    """
+
+    bottom_floor: int = 1
+    top_floor: int = 5
+    unserved: frozenset[int] = frozenset()
+    express_zones: tuple[tuple[int, int], ...] = ()
+
+    def __post_init__(self):
+        # Frozen, so the derived attributes have to be set the hard way
+        def derive(name, value):
+            object.__setattr__(self, name, value)
+
+        derive("unserved", frozenset(self.unserved))
+        derive("express_zones", tuple(tuple(zone) for zone in self.express_zones))
+        if self.top_floor < self.bottom_floor:
+            raise ValueError("The top floor can't be below the bottom floor")
+        floors = range(self.bottom_floor, self.top_floor + 1)
+        for low, high in self.express_zones:
+            if not self.bottom_floor <= low < high <= self.top_floor:
+                raise ValueError(f"Express zone {low}-{high} is outside the building")
+        served = frozenset(
+            floor
+            for floor in floors
+            if floor not in self.unserved
+            and not any(low < floor < high for low, high in self.express_zones)
+        )
+        if not served:
+            raise ValueError("A building has to serve at least one floor")
+
+        derive("floors", floors)
+        derive("n_floors", len(floors))
+        # Bits needed to store a floor relative to the bottom one
+        derive("floor_bits", (self.top_floor - self.bottom_floor).bit_length())
+        derive("served", served)
+        # Where a new car starts
+        derive("lowest_served", min(served))
+        # Nobody calls the car down from the lowest floor it stops at, or up
+        # from the highest
+        derive(
+            "hallway_buttons",
+            frozenset(
+                (floor, direction)
+                for direction, floor in product(BUTTON_DIRECTIONS, sorted(served))
+                if not (direction == "DOWN" and floor == self.lowest_served)
+                and not (direction == "UP" and floor == max(served))
+            ),
+        )
+        presses = [
+            Event(EventKind.ONBOARD_PANEL_BUTTON_PRESS, dest)
+            for dest in floors
+            if dest in served
+        ]
+        for direction, floor in product(BUTTON_DIRECTIONS, floors):
+            if (floor, direction) in self.hallway_buttons:
+                presses.append(Event(EventKind.HALLWAY_BUTTON_PRESS, floor, direction))
+        presses = tuple(presses)
+        derive("button_presses", presses)
+        # Each state gets one of a few shared tuples rather than its own copy
+        # of the button presses: those alone, those and loading complete,
+        # or those and the sensor of the floor a moving car is heading to
+        derive("_loading_events", (*presses, Event(EventKind.LOADING_COMPLETE)))
+        arrivals = {
+            floor: (*presses, Event(EventKind.FLOOR_SENSOR, floor))
+            for floor in range(self.bottom_floor - 1, self.top_floor + 2)
+        }
+        derive(
+            "_moving_events",
+            {
+                (direction, floor): arrivals[floor + step]
+                for direction, step in (("UP", 1), ("DOWN", -1))
+                for floor in floors
+            },
+        )
+        config = (self.bottom_floor, self.top_floor, self.unserved, self.express_zones)
+        derive("_hash", hash(config))
+
+    def __hash__(self):
+        return self._hash
+
+    def __reduce__(self):
+        # Rebuild from the configuration rather than shipping the tables, and
+        # only once per process
+        return _shared_building, (
+            self.bottom_floor,
+            self.top_floor,
+            self.unserved,
+            self.express_zones,
+        )
+
+    def check_served(self, floor: int):
+        if floor not in self.served:
+            raise RuntimeError(f"Floor {floor} is not served")
+
+    def events_for(self, mode: str, direction: str | None, floor: int) -> tuple:
+        """The events that can happen to an elevator in this state
+
+        Button presses can happen at any time. Besides those, a loading car can
+        finish loading, and a moving one can reach the next floor.
+        """
+        events = list(self.button_presses)
+        if mode == "LOADING":
+            events.append(Event(EventKind.LOADING_COMPLETE))
+        elif mode == "MOVING":
+            if direction == "UP":
+                events.append(Event(EventKind.FLOOR_SENSOR, floor + 1))
+            if direction == "DOWN":
+                events.append(Event(EventKind.FLOOR_SENSOR, floor - 1))
+        return tuple(events)
+
+    def possible_events(self, state) -> tuple[Event, ...]:
+        """`events_for()` an ElevatorState, from the tables built up front"""
+        if state.mode == "LOADING":
+            return self._loading_events
+        if state.mode == "MOVING" and state.direction is not None:
+            try:
+                return self._moving_events[state.direction, state.current_floor]
+            except KeyError:
+                # Only cars that went through the roof or the floor get here
+                return self.events_for(
+                    state.mode, state.direction, state.current_floor
+                )
+        return self.button_presses
+
+    @property
+    def all_events(self) -> tuple[Event, ...]:
+        """Every event possible_events() can return for a state in the building"""
+        return (
+            *self.button_presses,
+            *(Event(EventKind.FLOOR_SENSOR, floor) for floor in self.floors),
+            Event(EventKind.LOADING_COMPLETE),
+        )
+
+
+@lru_cache(maxsize=None)
+def _shared_building(*args) -> Building:
+    return Building(*args)
+
+
+DEFAULT_BUILDING = Building()
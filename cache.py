@@ -0,0 +1,196 @@
+import random
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from building import DEFAULT_BUILDING, Building
+from elevator import Elevator, Event
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    verified: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.hits} hits, {self.misses} misses ({self.hit_rate:.1%} hit rate), "
+            f"{self.evictions} evictions, {self.verified} hits verified"
+        )
+
+
+@dataclass(frozen=True)
+class Transition:
+    """What handling an event does to an elevator with a given code"""
+
+    # The code after the event (the same as before if it was rejected)
+    code: int
+    motor_state: str
+    # The message of the RuntimeError the handlers rejected the event with
+    error: str | None
+    # The message of the first invariant broken after the event
+    violation: str | None
+
+
+def _handle(elevator: Elevator, event: Event) -> Transition:
+    """Run the real handlers and invariants on `elevator`, in place"""
+    try:
+        Elevator.DISPATCH[elevator.mode, event.kind](elevator, event)
+        error = None
+    except RuntimeError as e:
+        error = str(e)
+    try:
+        elevator.invariants()
+        violation = None
+    except AssertionError as e:
+        violation = str(e)
+    return Transition(
+        elevator.to_code(), elevator.motor_controller.motor_state, error, violation
+    )
+
+
+def _decode(building: Building, code: int, motor_state: str) -> Elevator:
+    elevator = Elevator.from_code(code, building)
+    elevator.motor_controller.motor_state = motor_state
+    return elevator
+
+
+class TransitionCache:
+    """Remember where each (full state, event) pair leads, up to `maxsize` of them
+
+    Entries are keyed by `Elevator.to_code()`, motor state (which codes leave
+    out, but handlers don't always set) and event, and hold the resulting code
+    together with the verdict of the invariants, so a hit saves the handler
+    dispatch, any copy and the `invariants()` call. The least recently used
+    entry is evicted when the cache is full, and with `maxsize=None` (the
+    default) nothing ever is. Codes depend on the building, so a cache only
+    serves elevators in the `building` it was made for.
+
+    An exploration expands every state once, so a cache only pays off when
+    the same states are stepped again: exploring the same building twice, or
+    an elevator going back over its usual states. It has to be big enough to
+    hold all of them (the 5 floor full state graph has about a million
+    edges), or the least recently used entries are gone before they are
+    reused and every lookup is a miss.
+
+    Set it as the `transition_cache` of an Elevator to have `handle_event()`
+    go through it, or hand it to the Explorer. With `verify_rate` that share
+    of the hits is checked against the real handlers, and a mismatch raises
+    AssertionError. `verify()` does the same for the entries in the cache.
+    """
+
+    def __init__(
+        self,
+        building: Building = DEFAULT_BUILDING,
+        maxsize: int | None = None,
+        verify_rate: float = 0.0,
+        seed=None,
+    ):
+        self.building = building
+        self.maxsize = maxsize
+        self.verify_rate = verify_rate
+        self.stats = CacheStats()
+        self._entries: OrderedDict[tuple, Transition] = OrderedDict()
+        self._rng = random.Random(seed)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+
+    def _lookup(self, key: tuple) -> Transition | None:
+        transition = self._entries.get(key)
+        if transition is None:
+            self.stats.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats.hits += 1
+        if self.verify_rate and self._rng.random() < self.verify_rate:
+            self._check(key, transition)
+        return transition
+
+    def _check(self, key: tuple, transition: Transition):
+        code, motor_state, kind, floor, direction = key
+        event = Event(kind, floor, direction)
+        expected = _handle(_decode(self.building, code, motor_state), event)
+        assert transition == expected, (
+            f"Cached transition for state {code} and {event} is stale: "
+            f"{transition} != {expected}"
+        )
+        self.stats.verified += 1
+
+    def verify(self, samples: int | None = None, seed=None):
+        """Check cached entries against the real handlers, all by default
+
+        A stale one raises AssertionError, like `TransitionTable.verify()`.
+        """
+        entries = list(self._entries.items())
+        if samples is not None and samples < len(entries):
+            entries = random.Random(seed).sample(entries, samples)
+        for key, transition in entries:
+            self._check(key, transition)
+
+    def _store(self, key: tuple, transition: Transition):
+        self._entries[key] = transition
+        if self.maxsize is not None and len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    def transition(
+        self,
+        code: int,
+        event: Event,
+        motor_state: str = "OFF",
+        elevator: Elevator | None = None,
+    ) -> Transition:
+        """Where `event` takes an elevator with this code
+
+        On a miss the handlers run on `elevator` if given, which has to be in
+        that state already, and is put back in it afterwards. Otherwise the
+        code is decoded into a fresh one.
+        """
+        # Plain fields hash much faster than the Event itself
+        key = (code, motor_state, event.kind, event.floor, event.direction)
+        transition = self._lookup(key)
+        if transition is None:
+            if elevator is None:
+                elevator = _decode(self.building, code, motor_state)
+                transition = _handle(elevator, event)
+            else:
+                elevator.push_undo()
+                transition = _handle(elevator, event)
+                elevator.revert()
+            self._store(key, transition)
+        return transition
+
+    def step(self, elevator: Elevator, event: Event) -> str | None:
+        """Have `elevator` handle `event`, returning the invariant it broke if any
+
+        Raises the same RuntimeError as the handlers if they reject the event.
+        """
+        if elevator.building != self.building:
+            raise ValueError("The elevator is in another building than the cache")
+        key = (
+            elevator.to_code(),
+            elevator.motor_controller.motor_state,
+            event.kind,
+            event.floor,
+            event.direction,
+        )
+        transition = self._lookup(key)
+        if transition is None:
+            transition = _handle(elevator, event)
+            self._store(key, transition)
+        else:
+            elevator.set_code(transition.code)
+            elevator.motor_controller.motor_state = transition.motor_state
+        if transition.error is not None:
+            raise RuntimeError(transition.error)
+        return transition.violation
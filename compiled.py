@@ -0,0 +1,225 @@
+import hashlib
+import random
+import struct
+from array import array
+from pathlib import Path
+
+import building as building_module
+import elevator as elevator_module
+import events as events_module
+import idle
+import loading
+import moving
+import stopqueue
+from building import DEFAULT_BUILDING, Building
+from elevator import Elevator, ElevatorEvent, ElevatorState, as_event
+
+CACHE_DIR = Path(__file__).parent / ".elevator_cache"
+NO_TRANSITION = -1
+
+_MAGIC = b"ELEVTBL1"
+_HEADER = struct.Struct("<8sqq")
+
+
+def source_fingerprint(building: Building = DEFAULT_BUILDING) -> str:
+    """Hash of everything the behaviour of the elevator depends on
+
+    As "<hash of the sources>-<hash of the building>", so that `prune_cache()`
+    can tell the files made from older sources apart.
+    """
+    digest = hashlib.sha256()
+    for module in (
+        building_module,
+        elevator_module,
+        events_module,
+        idle,
+        loading,
+        moving,
+        stopqueue,
+    ):
+        digest.update(Path(module.__file__).read_bytes())
+    building_digest = hashlib.sha256(repr(building).encode())
+    return f"{digest.hexdigest()[:16]}-{building_digest.hexdigest()[:16]}"
+
+
+def prune_cache(cache_dir: Path, kind: str, fingerprint: str):
+    """Delete the `kind` files of `cache_dir` made from other sources
+
+    `fingerprint` is the one of the file just written, and the files sharing
+    the sources part of it (those of other buildings) are kept.
+    """
+    sources = fingerprint.split("-")[0]
+    for path in Path(cache_dir).glob(f"{kind}-*.bin"):
+        if not path.name.startswith(f"{kind}-{sources}-"):
+            path.unlink(missing_ok=True)
+
+
+def interpreted_step(
+    code: int, event: ElevatorEvent, building: Building = DEFAULT_BUILDING
+) -> int | None:
+    """Reference semantics: run the mode handlers on a decoded elevator
+
+    Returns the code of the resulting state, or None if the handlers reject
+    the event in this state.
+    """
+    elevator = Elevator.from_code(code, building)
+    try:
+        elevator.handle_event(event)
+    except RuntimeError:
+        return None
+    return elevator.to_code()
+
+
+class TransitionTable:
+    """Every reachable full state of the elevator and where each event takes it
+
+    States and events are numbered densely. `targets` is a flat array with
+    one row of `n_events` entries per state, holding the id of the next state
+    or NO_TRANSITION when the handlers reject the event. The codes are those
+    of elevators in `building`.
+    """
+
+    def __init__(
+        self,
+        codes: array,
+        targets: array,
+        events: list[ElevatorEvent],
+        building: Building = DEFAULT_BUILDING,
+    ):
+        self.codes = codes
+        self.building = building
+        self.targets = targets
+        self.events = events
+        self.n_events = len(events)
+        self.state_ids = {code: state_id for state_id, code in enumerate(codes)}
+        self.event_ids = {event: i for i, event in enumerate(events)}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def next_state(self, state_id: int, event_id: int) -> int:
+        return self.targets[state_id * self.n_events + event_id]
+
+    @classmethod
+    def compile(cls, root: Elevator | None = None) -> "TransitionTable":
+        root = root or Elevator()
+        building = root.building
+        events = list(building.all_events)
+        root_code = root.to_code()
+        # Codes are stored as 64 bit ints, which is plenty for any building
+        # small enough to enumerate
+        codes = array("q", [root_code])
+        state_ids = {root_code: 0}
+        targets = array("i")
+        # Ids are handed out in discovery order, so walking them in order is
+        # a BFS and each row of targets is appended in order
+        state_id = 0
+        while state_id < len(codes):
+            code = codes[state_id]
+            for event in events:
+                new_code = interpreted_step(code, event, building)
+                if new_code is None:
+                    targets.append(NO_TRANSITION)
+                    continue
+                if new_code not in state_ids:
+                    state_ids[new_code] = len(codes)
+                    codes.append(new_code)
+                targets.append(state_ids[new_code])
+            state_id += 1
+        return cls(codes, targets, events, building)
+
+    def verify(self, samples: int = 1000, seed=None):
+        """Check random entries of the table against the interpreted handlers"""
+        rng = random.Random(seed)
+        for _ in range(samples):
+            state_id = rng.randrange(len(self.codes))
+            event_id = rng.randrange(self.n_events)
+            expected = interpreted_step(
+                self.codes[state_id], self.events[event_id], self.building
+            )
+            target = self.next_state(state_id, event_id)
+            actual = None if target == NO_TRANSITION else self.codes[target]
+            assert actual == expected, (
+                f"Table disagrees with the handlers for state {self.codes[state_id]} "
+                f"and {self.events[event_id]}: {actual} != {expected}"
+            )
+
+    def save(self, path: Path):
+        with open(path, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, len(self.codes), self.n_events))
+            self.codes.tofile(f)
+            self.targets.tofile(f)
+
+    @classmethod
+    def load(
+        cls, path: Path, building: Building = DEFAULT_BUILDING
+    ) -> "TransitionTable":
+        events = list(building.all_events)
+        with open(path, "rb") as f:
+            magic, n_states, n_events = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC or n_events != len(events):
+                raise ValueError(f"{path} is not a transition table for this elevator")
+            codes = array("q")
+            codes.fromfile(f, n_states)
+            targets = array("i")
+            targets.fromfile(f, n_states * n_events)
+        return cls(codes, targets, events, building)
+
+    @classmethod
+    def cached(
+        cls,
+        cache_dir: Path = CACHE_DIR,
+        verify_samples: int = 1000,
+        building: Building = DEFAULT_BUILDING,
+    ):
+        """Load the table for the current sources, compiling it if needed
+
+        The file name includes `source_fingerprint()`, so editing any of the
+        modules the elevator is made of, or using another building, gets
+        another table. Writing one deletes the tables of older sources.
+        """
+        fingerprint = source_fingerprint(building)
+        path = Path(cache_dir) / f"transitions-{fingerprint}.bin"
+        if path.exists():
+            table = cls.load(path, building)
+        else:
+            table = cls.compile(Elevator(building=building))
+            path.parent.mkdir(parents=True, exist_ok=True)
+            table.save(path)
+            prune_cache(cache_dir, "transitions", fingerprint)
+        table.verify(verify_samples)
+        return table
+
+
+class CompiledElevator:
+    """An elevator that steps by looking its next state up in a TransitionTable"""
+
+    def __init__(self, table: TransitionTable, state_id: int = 0):
+        self.table = table
+        self.state_id = state_id
+
+    def __repr__(self):
+        return f"CompiledElevator({self.to_elevator()!r})"
+
+    def step(self, event_id: int):
+        target = self.table.targets[self.state_id * self.table.n_events + event_id]
+        if target == NO_TRANSITION:
+            kind = self.table.events[event_id].kind
+            raise RuntimeError(f"Received {kind} in {self.state}")
+        self.state_id = target
+
+    def handle_event(self, event: ElevatorEvent):
+        event_id = self.table.event_ids.get(as_event(event))
+        if event_id is None:
+            raise RuntimeError("Unsupported Event")
+        self.step(event_id)
+
+    def to_code(self) -> int:
+        return self.table.codes[self.state_id]
+
+    def to_elevator(self) -> Elevator:
+        return Elevator.from_code(self.to_code(), self.table.building)
+
+    @property
+    def state(self) -> ElevatorState:
+        return self.to_elevator().state
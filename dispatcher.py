@@ -0,0 +1,122 @@
+from elevator import Elevator, ElevatorEvent, Event, EventKind, as_event
+from modes import IDLE, LOADING
+
+
+def _stops_between(mask: int, offset: int, low: int, high: int) -> int:
+    """How many floors of a StopQueue mask lie in low..high (inclusive)"""
+    if high < low:
+        return 0
+    low_bit = max(low - offset, 0)
+    high_bit = high - offset + 1
+    if high_bit <= 0:
+        return 0
+    return (mask & ((1 << high_bit) - (1 << low_bit))).bit_count()
+
+
+class GroupController:
+    """Dispatch hallway calls across a bank of elevators
+
+    Every HALLWAY_BUTTON_PRESS goes to exactly one car: the one with the
+    lowest estimated time of arrival for that call. Anything else happens
+    inside (or to) a particular car, so it needs the index of that car.
+
+    Estimates only depend on a car's mode, direction, floor and stops, so
+    they are memoised per car and thrown away as soon as any of those change.
+    Between changes, assigning a call costs a dict lookup per car.
+    """
+
+    def __init__(self, cars: int | list[Elevator], travel_time=2.0, door_time=10.0):
+        if isinstance(cars, int):
+            cars = [Elevator() for _ in range(cars)]
+        self.cars = cars
+        self.travel_time = travel_time
+        self.door_time = door_time
+        # (car state key, {(floor, direction): eta}) for every car
+        self._eta_cache = [(None, {}) for _ in cars]
+
+    def handle_event(
+        self, event: Event | ElevatorEvent, car: int | None = None
+    ) -> int:
+        """Forward an event to a car and return the index of that car"""
+        event = as_event(event)
+        if event.kind == EventKind.HALLWAY_BUTTON_PRESS:
+            car = self.assign(event.floor, event.direction)
+        elif car is None:
+            raise ValueError(f"{event.kind} has to be sent to a particular car")
+        self.cars[car].handle_event(event)
+        return car
+
+    def assign(self, floor: int, direction: str) -> int:
+        best_car, best_eta = 0, float("inf")
+        for car in range(len(self.cars)):
+            eta = self.eta(car, floor, direction)
+            if eta < best_eta:
+                best_car, best_eta = car, eta
+        return best_car
+
+    def eta(self, car: int, floor: int, direction: str) -> float:
+        elev = self.cars[car]
+        key = (
+            elev.mode,
+            elev.direction,
+            elev.current_floor,
+            elev.stops.mask,
+            elev.stops_for_later.mask,
+        )
+        cached_key, etas = self._eta_cache[car]
+        if cached_key != key:
+            etas = {}
+            self._eta_cache[car] = (key, etas)
+        call = (floor, direction)
+        if call not in etas:
+            etas[call] = self._estimate(elev, floor, direction)
+        return etas[call]
+
+    def _estimate(self, elev: Elevator, floor: int, direction: str) -> float:
+        """Time until `elev` could pick up a call, following its current sweep
+
+        The car is assumed to serve everything in `stops`, turn around at its
+        furthest stop and serve `stops_for_later` on the way back, as the mode
+        handlers do. Each stop on the way costs `door_time`.
+        """
+        here = elev.current_floor
+        # A car that is loading still has part of its door time to go
+        wait = self.door_time / 2 if elev.mode == LOADING else 0.0
+        if elev.mode == IDLE or elev.direction is None:
+            return wait + abs(floor - here) * self.travel_time
+
+        offset = elev.stops.offset
+        stops, later = elev.stops.mask, elev.stops_for_later.mask
+        if elev.direction == "UP":
+            ahead = floor > here or (floor == here and elev.mode == LOADING)
+            if ahead and direction == "UP":
+                distance = floor - here
+                doors = _stops_between(stops, offset, here + 1, floor - 1)
+            else:
+                # Up to the furthest stop, then back down to the call
+                top = max(elev.stops.max() if stops else here, here, floor)
+                distance = (top - here) + (top - floor)
+                doors = stops.bit_count() + _stops_between(
+                    later, offset, floor + 1, top
+                )
+                if direction == "UP":
+                    # ...and back up again once everything below is served
+                    bottom = min(elev.stops_for_later.min() if later else floor, floor)
+                    distance += 2 * (floor - bottom)
+                    doors = stops.bit_count() + later.bit_count()
+        else:
+            ahead = floor < here or (floor == here and elev.mode == LOADING)
+            if ahead and direction == "DOWN":
+                distance = here - floor
+                doors = _stops_between(stops, offset, floor + 1, here - 1)
+            else:
+                bottom = min(elev.stops.min() if stops else here, here, floor)
+                distance = (here - bottom) + (floor - bottom)
+                doors = stops.bit_count() + _stops_between(
+                    later, offset, bottom, floor - 1
+                )
+                if direction == "DOWN":
+                    top = max(elev.stops_for_later.max() if later else floor, floor)
+                    distance += 2 * (top - floor)
+                    doors = stops.bit_count() + later.bit_count()
+        return wait + distance * self.travel_time + doors * self.door_time
@@ -1,19 +1,10 @@
-from dataclasses import dataclass
-from copy import copy
+from dataclasses import dataclass, field
 from typing import Literal
 
+from building import DEFAULT_BUILDING, Building
+from events import ElevatorEvent, Event, EventKind, as_event  # noqa: F401
 from modes import MOVING, IDLE, LOADING
-
-
-@dataclass
-class ElevatorEvent:
-    kind: Literal[
-        "ONBOARD_PANEL_BUTTON_PRESS",
-        "FLOOR_SENSOR",
-        "HALLWAY_BUTTON_PRESS",
-        "LOADING_COMPLETE",
-    ]
-    payload: dict | None = None
+from stopqueue import StopQueue
 
 
 # Super dumb class representing the motor control
@@ -28,27 +19,72 @@ class MotorController:
         self.motor_state = "OFF"
 
 
+MODES = (IDLE, MOVING, LOADING)
+DIRECTIONS = (None, "UP", "DOWN")
+
+
+def _build_dispatch_table() -> dict:
+    """Map (mode, event kind) to a function handling that event in that mode"""
+    table = {}
+    for mode in MODES:
+        table[mode, EventKind.ONBOARD_PANEL_BUTTON_PRESS] = (
+            lambda elev, event, handler=mode.handle_onboard_button_press: handler(
+                elev, event.floor
+            )
+        )
+        table[mode, EventKind.FLOOR_SENSOR] = (
+            lambda elev, event, handler=mode.handle_floor_sensor_input: handler(
+                elev, event.floor
+            )
+        )
+        table[mode, EventKind.HALLWAY_BUTTON_PRESS] = (
+            lambda elev, event, handler=mode.handle_hallway_button_press: handler(
+                elev, event.floor, event.direction
+            )
+        )
+        table[mode, EventKind.LOADING_COMPLETE] = (
+            lambda elev, event, handler=mode.handle_loading_complete: handler(elev)
+        )
+    return table
+
+
 @dataclass(eq=True, frozen=True)
 class ElevatorState:
     mode: Literal["IDLE", "MOVING", "LOADING"]
     direction: Literal["UP", "DOWN"] | None
     current_floor: int
+    # Tells apart states of elevators in different buildings
+    building: Building = field(default=DEFAULT_BUILDING, repr=False)
 
 
 class Elevator:
-    TOP_FLOOR = 5
-    BOTTOM_FLOOR = 1
+    DISPATCH = _build_dispatch_table()
+    # Set to a cache.TransitionCache to step through it instead of the handlers
+    transition_cache = None
 
-    def __init__(self, mode=IDLE, current_floor=1, direction=None):
+    def __init__(
+        self,
+        mode=IDLE,
+        current_floor=None,
+        direction=None,
+        building: Building = DEFAULT_BUILDING,
+    ):
+        self.building = building
         self.mode = mode
+        if current_floor is None:
+            current_floor = building.lowest_served
         self.current_floor = current_floor
         self.direction = direction
 
         self.motor_controller = MotorController()
 
-        self.stops = set()
-        self.stops_for_later = set()
-        self.stops_for_after_later = set()
+        offset, size = building.bottom_floor, building.n_floors
+        self.stops = StopQueue(offset=offset, size=size)
+        self.stops_for_later = StopQueue(offset=offset, size=size)
+        self.stops_for_after_later = StopQueue(offset=offset, size=size)
+
+        # One entry per event handled with record=True, see `revert()`
+        self.undo_log = []
 
     def __repr__(self):
         return (
@@ -58,13 +94,74 @@ class Elevator:
 
     def copy(self) -> "Elevator":
         new_elevator = Elevator(
-            mode=self.mode, current_floor=self.current_floor, direction=self.direction
+            mode=self.mode,
+            current_floor=self.current_floor,
+            direction=self.direction,
+            building=self.building,
         )
-        new_elevator.stops = copy(self.stops)
-        new_elevator.stops_for_later = copy(self.stops_for_later)
-        new_elevator.stops_for_after_later = copy(self.stops_for_after_later)
+        new_elevator.stops = self.stops.copy()
+        new_elevator.stops_for_later = self.stops_for_later.copy()
+        new_elevator.stops_for_after_later = self.stops_for_after_later.copy()
+        if self.transition_cache is not None:
+            new_elevator.transition_cache = self.transition_cache
         return new_elevator
 
+    def to_code(self) -> int:
+        """Encode the full state of the Elevator as a single int
+
+        From the least significant bit up, the code holds:
+            - mode (2 bits)
+            - direction (2 bits)
+            - current_floor, relative to the bottom floor of the building
+            - stops, stops_for_later and stops_for_after_later, as one bit per
+              floor each
+        Unlike `state` this includes the stops, so two elevators have the same
+        code only if they will behave the same way from now on. Codes only
+        make sense together with the building of the elevator.
+
+        Raises ValueError for a car outside its building, which has no code:
+        its floor would be taken for another one.
+        """
+        building = self.building
+        n_floors = building.n_floors
+        floor = self.current_floor - building.bottom_floor
+        if not 0 <= floor < n_floors:
+            raise ValueError(
+                f"Floor {self.current_floor} is outside the building, so it has "
+                "no code"
+            )
+        code = self.stops_for_after_later.mask
+        code = (code << n_floors) | self.stops_for_later.mask
+        code = (code << n_floors) | self.stops.mask
+        code = (code << building.floor_bits) | floor
+        code = (code << 2) | DIRECTIONS.index(self.direction)
+        code = (code << 2) | MODES.index(self.mode)
+        return code
+
+    @classmethod
+    def from_code(cls, code: int, building: Building = DEFAULT_BUILDING) -> "Elevator":
+        elevator = cls(building=building)
+        elevator.set_code(code)
+        return elevator
+
+    def set_code(self, code: int):
+        """Put the elevator in the state `to_code()` returned `code` for"""
+        building = self.building
+        n_floors = building.n_floors
+        floor_bits = building.floor_bits
+        all_floors = (1 << n_floors) - 1
+        self.mode = MODES[code & 0b11]
+        self.direction = DIRECTIONS[(code >> 2) & 0b11]
+        self.current_floor = ((code >> 4) & ((1 << floor_bits) - 1)) + (
+            building.bottom_floor
+        )
+        code >>= 4 + floor_bits
+        self.stops.mask = code & all_floors
+        code >>= n_floors
+        self.stops_for_later.mask = code & all_floors
+        code >>= n_floors
+        self.stops_for_after_later.mask = code & all_floors
+
     @property
     def state(self) -> ElevatorState:
         """Return the current state of the Elevator
@@ -73,12 +170,14 @@ class Elevator:
             - mode
             - direction
             - current_floor
-        The list of stops will not be part of the state, for now
+        The list of stops will not be part of the state, for now. Use
+        `to_code()` when the stops matter.
         """
         curr_state = ElevatorState(
             mode=self.mode.__name__,
             direction=self.direction,
             current_floor=self.current_floor,
+            building=self.building,
         )
         return curr_state
 
@@ -92,53 +191,88 @@ class Elevator:
         assert not (
             self.mode == IDLE and self.direction is not None
         ), "IDLE but with a direction"
-        assert not (self.current_floor > Elevator.TOP_FLOOR), "Went through roof"
-        assert not (self.current_floor < Elevator.BOTTOM_FLOOR), "Went through floor"
+        building = self.building
+        assert not (self.current_floor > building.top_floor), "Went through roof"
+        assert not (self.current_floor < building.bottom_floor), "Went through floor"
         assert not (self.mode == MOVING and not self.stops), "Moving with no stops"
         assert not (
             self.mode == MOVING
             and self.direction == "UP"
-            and max(self.stops) <= self.current_floor
+            and self.stops.max() <= self.current_floor
         ), "Moving up and stops for now are below"
         assert not (
             self.mode == MOVING
             and self.direction == "DOWN"
-            and min(self.stops) >= self.current_floor
+            and self.stops.min() >= self.current_floor
         ), "Moving down and stops for now are above"
         assert not (
             self.mode == MOVING
             and self.direction == "DOWN"
-            and self.current_floor == Elevator.BOTTOM_FLOOR
+            and self.current_floor == building.bottom_floor
         ), "Moving down from the bottom floor"
         assert not (
             self.mode == MOVING
             and self.direction == "UP"
-            and self.current_floor == Elevator.TOP_FLOOR
+            and self.current_floor == building.top_floor
         ), "Moving up from the top floor"
         assert not (
-            self.stops.intersection(self.stops_for_later).intersection(
-                self.stops_for_after_later
-            )
+            self.stops.mask
+            & self.stops_for_later.mask
+            & self.stops_for_after_later.mask
         ), "The same floor can't be in more than one stop lists"
 
-    def handle_event(self, event: ElevatorEvent):
+    def handle_event(self, event: Event | ElevatorEvent, record: bool = False):
         # input: ElevatorInstruction = ElevatorInstruction() # Translate an input (button press) into an instruction (go to floor N)  # noqa: B950
-        if event.kind == "ONBOARD_PANEL_BUTTON_PRESS":
-            self.mode.handle_onboard_button_press(
-                self, dest_floor=event.payload["dest"]
-            )
-        elif event.kind == "FLOOR_SENSOR":
-            self.mode.handle_floor_sensor_input(self, floor=event.payload["floor"])
-        elif event.kind == "HALLWAY_BUTTON_PRESS":
-            self.mode.handle_hallway_button_press(
-                self,
-                floor=event.payload["floor"],
-                direction=event.payload["direction"],
-            )
-        elif event.kind == "LOADING_COMPLETE":
-            self.mode.handle_loading_complete(self)
+        if type(event) is not Event:
+            event = Event.from_elevator_event(event)
+        if record:
+            self.push_undo()
+        if self.transition_cache is None:
+            self.DISPATCH[self.mode, event.kind](self, event)
         else:
-            raise RuntimeError("Unsupported Event")
+            self.transition_cache.step(self, event)
+
+    def handle_events(self, events):
+        """Handle events one after the other, stopping at the first rejected one"""
+        if self.transition_cache is not None:
+            for event in events:
+                self.transition_cache.step(self, as_event(event))
+            return
+        dispatch = self.DISPATCH
+        for event in events:
+            if type(event) is not Event:
+                event = Event.from_elevator_event(event)
+            dispatch[self.mode, event.kind](self, event)
+
+    def push_undo(self):
+        """Save the current state for the next `revert()`"""
+        self.undo_log.append(
+            (
+                self.mode,
+                self.direction,
+                self.current_floor,
+                self.stops.mask,
+                self.stops_for_later.mask,
+                self.stops_for_after_later.mask,
+                self.motor_controller.motor_state,
+            )
+        )
+
+    def revert(self):
+        """Undo the last event handled with `handle_event(event, record=True)`
+
+        Searches can step a single elevator forwards and back like this
+        instead of copying it for every event they try.
+        """
+        (
+            self.mode,
+            self.direction,
+            self.current_floor,
+            self.stops.mask,
+            self.stops_for_later.mask,
+            self.stops_for_after_later.mask,
+            self.motor_controller.motor_state,
+        ) = self.undo_log.pop()
 
     def move(self, direction: Literal["UP", "DOWN"]):
         self.mode = MOVING
@@ -153,9 +287,13 @@ class Elevator:
     def change_direction(self):
         assert self.direction in ("UP", "DOWN")
         self.direction = "UP" if self.direction == "DOWN" else "DOWN"
-        self.stops = copy(self.stops_for_later)
-        self.stops_for_later = copy(self.stops_for_after_later)
-        self.stops_for_after_later = set()
+        # Rotate the queues rather than copying them around
+        self.stops, self.stops_for_later, self.stops_for_after_later = (
+            self.stops_for_later,
+            self.stops_for_after_later,
+            self.stops,
+        )
+        self.stops_for_after_later.clear()
         self.mode = MOVING
 
     def go_idle(self):
@@ -0,0 +1,89 @@
+from dataclasses import dataclass
+from enum import Enum
+from typing import Literal
+
+
+@dataclass
+class ElevatorEvent:
+    kind: Literal[
+        "ONBOARD_PANEL_BUTTON_PRESS",
+        "FLOOR_SENSOR",
+        "HALLWAY_BUTTON_PRESS",
+        "LOADING_COMPLETE",
+    ]
+    payload: dict | None = None
+
+
+class EventKind(str, Enum):
+    # Members compare (and hash) equal to the plain strings ElevatorEvent uses
+    ONBOARD_PANEL_BUTTON_PRESS = "ONBOARD_PANEL_BUTTON_PRESS"
+    FLOOR_SENSOR = "FLOOR_SENSOR"
+    HALLWAY_BUTTON_PRESS = "HALLWAY_BUTTON_PRESS"
+    LOADING_COMPLETE = "LOADING_COMPLETE"
+
+
+class Event:
+    """A compact ElevatorEvent, with plain fields instead of a payload dict
+
+    `floor` is the destination of an onboard button press, or the floor of a
+    hallway button press or of a floor sensor. `direction` is only set for
+    hallway button presses. Events are hashable, so treat them as immutable.
+    """
+
+    __slots__ = ("kind", "floor", "direction")
+
+    def __init__(
+        self,
+        kind: EventKind,
+        floor: int | None = None,
+        direction: Literal["UP", "DOWN"] | None = None,
+    ):
+        self.kind = kind
+        self.floor = floor
+        self.direction = direction
+
+    @classmethod
+    def from_elevator_event(cls, event: ElevatorEvent) -> "Event":
+        try:
+            kind = EventKind(event.kind)
+        except ValueError:
+            raise RuntimeError("Unsupported Event") from None
+        payload = event.payload or {}
+        return cls(
+            kind, payload.get("dest", payload.get("floor")), payload.get("direction")
+        )
+
+    @property
+    def payload(self) -> dict | None:
+        """The payload of the equivalent ElevatorEvent"""
+        if self.kind == EventKind.ONBOARD_PANEL_BUTTON_PRESS:
+            return {"dest": self.floor}
+        if self.kind == EventKind.FLOOR_SENSOR:
+            return {"floor": self.floor}
+        if self.kind == EventKind.HALLWAY_BUTTON_PRESS:
+            return {"floor": self.floor, "direction": self.direction}
+        return None
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Event):
+            return NotImplemented
+        return (
+            self.kind == other.kind
+            and self.floor == other.floor
+            and self.direction == other.direction
+        )
+
+    def __hash__(self) -> int:
+        return hash((self.kind, self.floor, self.direction))
+
+    def __repr__(self):
+        return (
+            f"Event({EventKind(self.kind).name}, floor={self.floor}, "
+            f"direction={self.direction})"
+        )
+
+
+def as_event(event: Event | ElevatorEvent) -> Event:
+    if type(event) is Event:
+        return event
+    return Event.from_elevator_event(event)
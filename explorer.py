@@ -0,0 +1,414 @@
+import time
+from array import array
+from collections import deque
+from dataclasses import dataclass
+from multiprocessing import Pool
+from typing import Literal
+
+from building import DEFAULT_BUILDING, Building
+from cache import TransitionCache
+from elevator import Elevator, ElevatorEvent, Event, EventKind
+
+
+@dataclass
+class ExplorationStats:
+    states: int = 0
+    edges: int = 0
+    seconds: float = 0.0
+
+    @property
+    def states_per_second(self) -> float:
+        if not self.seconds:
+            return 0.0
+        return self.states / self.seconds
+
+    def __str__(self):
+        return (
+            f"{self.states} states, {self.edges} edges in {self.seconds:.2f}s "
+            f"({self.states_per_second:.0f} states/s)"
+        )
+
+
+@dataclass
+class Violation:
+    # Ids of the state the event was handled in and of the state it led to
+    source: int
+    target: int
+    event: Event
+    message: str
+
+
+class CounterexampleFound(AssertionError):
+    """An invariant broke, along with the shortest way found to break it"""
+
+    def __init__(self, violation: Violation, events: list[Event], script: str):
+        super().__init__(violation.message)
+        self.violation = violation
+        self.events = events
+        self.script = script
+
+
+def replay_script(
+    events: list[Event],
+    root: int | None = None,
+    building: Building = DEFAULT_BUILDING,
+) -> str:
+    """Python source replaying `events` on an elevator and checking it after
+
+    The elevator starts as `Elevator()`, or as `Elevator.from_code(root)`, in
+    `building`.
+    """
+    imports = ["from elevator import Elevator, ElevatorEvent"]
+    if building == DEFAULT_BUILDING:
+        start = "Elevator()" if root is None else f"Elevator.from_code({root})"
+    else:
+        imports.insert(0, "from building import Building")
+        if root is None:
+            start = f"Elevator(building={building!r})"
+        else:
+            start = f"Elevator.from_code({root}, {building!r})"
+    lines = [
+        *imports,
+        "",
+        f"elevator = {start}",
+        "for event in [",
+    ]
+    for event in events:
+        elevator_event = ElevatorEvent(EventKind(event.kind).value, event.payload)
+        lines.append(f"    {elevator_event!r},")
+    lines += [
+        "]:",
+        "    elevator.handle_event(event)",
+        "elevator.invariants()",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+class StateGraph:
+    """The explored transition graph in compressed sparse row form
+
+    The edges out of state `i` are `targets[offsets[i]:offsets[i + 1]]`, each
+    one labelled with the id of its event in `events_by_edge`. `keys[i]` is
+    the key the explorer used for state `i` (an `Elevator.to_code()` with
+    `full_state`, to decode with `building`), and `violating[i]` is 1 for
+    states that broke an invariant. Those states are in the graph but were
+    never expanded.
+    """
+
+    def __init__(
+        self,
+        keys: list,
+        events: list[Event],
+        sources: array,
+        targets: array,
+        events_by_edge: array,
+        violating: bytearray,
+        building: Building = DEFAULT_BUILDING,
+    ):
+        n_states = len(keys)
+        # Counting sort of the edges by source
+        offsets = array("q", [0]) * (n_states + 1)
+        for source in sources:
+            offsets[source + 1] += 1
+        for i in range(n_states):
+            offsets[i + 1] += offsets[i]
+        position = array("q", offsets[:-1])
+        sorted_targets = array("l", [0]) * len(targets)
+        sorted_events = array("h", [0]) * len(targets)
+        for source, target, event_id in zip(sources, targets, events_by_edge):
+            sorted_targets[position[source]] = target
+            sorted_events[position[source]] = event_id
+            position[source] += 1
+
+        self.keys = keys
+        self.events = events
+        self.offsets = offsets
+        self.targets = sorted_targets
+        self.events_by_edge = sorted_events
+        self.violating = violating
+        self.building = building
+
+    @classmethod
+    def from_csr(
+        cls,
+        keys,
+        events: list[Event],
+        offsets,
+        targets,
+        events_by_edge,
+        violating,
+        building: Building = DEFAULT_BUILDING,
+    ) -> "StateGraph":
+        """A graph from edges already sorted by source, without copying them
+
+        The arrays only need to be indexable, so memoryviews (of an mmap, say)
+        will do.
+        """
+        graph = cls.__new__(cls)
+        graph.keys = keys
+        graph.events = events
+        graph.offsets = offsets
+        graph.targets = targets
+        graph.events_by_edge = events_by_edge
+        graph.violating = violating
+        graph.building = building
+        return graph
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.targets)
+
+    def edges(self, state_id: int):
+        """(target, event id) for every edge out of `state_id`"""
+        start, end = self.offsets[state_id], self.offsets[state_id + 1]
+        return zip(self.targets[start:end], self.events_by_edge[start:end])
+
+
+def _expand_batch(args):
+    """Expand a batch of states into their successors
+
+    Runs inside the worker processes, so it has to be a module level function.
+    With `full_state` the batch and the successors are `Elevator.to_code()`
+    ints, which are much cheaper to ship around than pickled elevators.
+
+    Returns the (deduplicated) successors to explore as (key, successor,
+    parent key, event), the number of edges, and either every edge as (source
+    key, event, target key, violation message or None) if `keep_edges`, or
+    only the ones breaking an invariant if not.
+    """
+    get_events, full_state, building, keep_edges, cache, items = args
+    children = {}
+    edges = []
+    n_edges = 0
+    for item in items:
+        # Step a single elevator forwards and back for every event, and only
+        # copy it when it lands somewhere this batch hasn't been yet
+        elevator = Elevator.from_code(item, building) if full_state else item
+        key = item if full_state else elevator.state
+        for event in get_events(elevator.state):
+            n_edges += 1
+            if cache is not None and full_state:
+                # Straight from code to code, the elevator is only stepped
+                # (and put back) on a miss
+                transition = cache.transition(item, event, elevator=elevator)
+                if transition.error is not None:
+                    raise RuntimeError(transition.error)
+                new_key, message = transition.code, transition.violation
+            else:
+                if cache is None:
+                    elevator.handle_event(event, record=True)
+                    try:
+                        elevator.invariants()
+                        message = None
+                    except AssertionError as e:
+                        message = str(e)
+                else:
+                    # The cache knows the verdict of the invariants too
+                    elevator.push_undo()
+                    message = cache.step(elevator, event)
+                new_key = elevator.to_code() if full_state else elevator.state
+            if keep_edges or message is not None:
+                edges.append((key, event, new_key, message))
+            # No point in shipping the same state back twice, and states that
+            # are already broken aren't worth exploring further
+            if message is None and new_key not in children:
+                child = new_key if full_state else elevator.copy()
+                children[new_key] = (new_key, child, key, event)
+            if elevator.undo_log:
+                elevator.revert()
+    return list(children.values()), n_edges, edges
+
+
+class Explorer:
+    """Walk every state reachable from an elevator using an explicit frontier
+
+    The frontier is consumed in batches. With more than one process the
+    batches are expanded by a process pool, and the visited set lives in the
+    parent, so states found by different workers are deduplicated in one place.
+
+    By default states are told apart by `Elevator.state`, which ignores the
+    stops. With `full_state=True` they are told apart (and stored) by
+    `Elevator.to_code()` instead, and `explore()` returns a set of codes.
+
+    Every state remembers the state and event it was discovered from, in
+    `parents` and `parent_events` (6 bytes per state), so `path_to()` can
+    rebuild how it was reached. With BFS that is a shortest path.
+
+    A broken invariant raises CounterexampleFound with the events leading to
+    it, unless `stop_on_violation=False`. Then it is added to `violations` and
+    the state that broke it isn't explored further. With `keep_graph=True`
+    every edge is kept, and `graph` is a StateGraph after exploring.
+
+    A TransitionCache makes exploring the same building again (or any states
+    it has seen before) skip the handlers and invariants. A single exploration
+    never hits it, since every state is expanded once, so it is off unless
+    given. It lives in this process, so it only works with `processes=1`.
+    """
+
+    def __init__(
+        self,
+        get_events,
+        strategy: Literal["BFS", "DFS"] = "BFS",
+        processes: int = 1,
+        batch_size: int = 64,
+        full_state: bool = False,
+        stop_on_violation: bool = True,
+        keep_graph: bool = False,
+        transition_cache: TransitionCache | None = None,
+    ):
+        if strategy not in ("BFS", "DFS"):
+            raise ValueError(f"Unknown exploration strategy: {strategy}")
+        if transition_cache is not None and processes > 1:
+            raise ValueError("A transition cache only works with processes=1")
+        self.get_events = get_events
+        self.strategy = strategy
+        self.processes = processes
+        self.batch_size = batch_size
+        self.full_state = full_state
+        self.stop_on_violation = stop_on_violation
+        self.keep_graph = keep_graph
+        self.transition_cache = transition_cache
+        self.stats = ExplorationStats()
+        self.violations: list[Violation] = []
+        self.graph: StateGraph | None = None
+        self.events: list[Event] = []
+        self.parents = array("i")
+        self.parent_events = array("h")
+        self.root_code: int | None = None
+        self.building = DEFAULT_BUILDING
+
+    def _take_batches(self, frontier: deque) -> list:
+        # Enough batches to keep every worker busy, but no more, so that DFS
+        # still goes deep instead of turning into BFS
+        pop = frontier.popleft if self.strategy == "BFS" else frontier.pop
+        batches = []
+        while frontier and len(batches) < self.processes:
+            size = min(self.batch_size, len(frontier))
+            batch = [pop() for _ in range(size)]
+            batches.append(
+                (
+                    self.get_events,
+                    self.full_state,
+                    self.building,
+                    self.keep_graph,
+                    self.transition_cache,
+                    batch,
+                )
+            )
+        return batches
+
+    def path_to(self, state_id: int) -> list[Event]:
+        """The events leading from the root to a state"""
+        events = []
+        while self.parents[state_id] != -1:
+            events.append(self.events[self.parent_events[state_id]])
+            state_id = self.parents[state_id]
+        events.reverse()
+        return events
+
+    def counterexample(self, violation: Violation) -> list[Event]:
+        """The events leading from the root to a violation, included"""
+        return self.path_to(violation.source) + [violation.event]
+
+    def replay_script(self, violation: Violation) -> str:
+        building = self.building
+        root = self.root_code
+        if root == Elevator(building=building).to_code():
+            root = None
+        return replay_script(self.counterexample(violation), root, building)
+
+    def explore(self, root: Elevator) -> set:
+        self.stats = ExplorationStats()
+        self.violations = []
+        self.graph = None
+        self.events = []
+        self.parents = array("i", [-1])
+        self.parent_events = array("h", [-1])
+        self.root_code = root.to_code()
+        self.building = root.building
+        cache = self.transition_cache
+        if cache is not None and cache.building != self.building:
+            raise ValueError("The transition cache is for another building")
+        start = time.perf_counter()
+
+        if self.full_state:
+            root = root.to_code()
+            root_key = root
+        else:
+            root_key = root.state
+        # State ids are handed out in discovery order
+        ids = {root_key: 0}
+        frontier = deque([root])
+
+        event_ids = {}
+        events = self.events
+        sources, targets, events_by_edge = array("l"), array("l"), array("h")
+        violating = bytearray(1)
+
+        def event_id(event: Event) -> int:
+            if event not in event_ids:
+                event_ids[event] = len(events)
+                events.append(event)
+            return event_ids[event]
+
+        def state_id(key, parent_key, event: Event) -> int:
+            if key not in ids:
+                ids[key] = len(ids)
+                violating.append(0)
+                self.parents.append(ids[parent_key])
+                self.parent_events.append(event_id(event))
+            return ids[key]
+
+        pool = Pool(self.processes) if self.processes > 1 else None
+        try:
+            while frontier:
+                batches = self._take_batches(frontier)
+                if pool is None:
+                    results = map(_expand_batch, batches)
+                else:
+                    # In order, so that states are discovered in BFS order and
+                    # the paths to them are shortest
+                    results = pool.imap(_expand_batch, batches)
+                for children, n_edges, edges in results:
+                    self.stats.edges += n_edges
+                    for key, child, parent_key, event in children:
+                        if key not in ids:
+                            state_id(key, parent_key, event)
+                            frontier.append(child)
+                    for key, event, new_key, message in edges:
+                        target = state_id(new_key, key, event)
+                        if message is not None:
+                            violating[target] = 1
+                            violation = Violation(ids[key], target, event, message)
+                            self.violations.append(violation)
+                            if self.stop_on_violation:
+                                raise CounterexampleFound(
+                                    violation,
+                                    self.counterexample(violation),
+                                    self.replay_script(violation),
+                                )
+                        if self.keep_graph:
+                            sources.append(ids[key])
+                            targets.append(target)
+                            events_by_edge.append(event_id(event))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        if self.keep_graph:
+            self.graph = StateGraph(
+                list(ids),
+                events,
+                sources,
+                targets,
+                events_by_edge,
+                violating,
+                self.building,
+            )
+        self.stats.states = len(ids)
+        self.stats.seconds = time.perf_counter() - start
+        return set(ids)
@@ -0,0 +1,283 @@
+from array import array
+from typing import Iterable
+
+from building import DEFAULT_BUILDING, Building
+from elevator import (
+    DIRECTIONS,
+    MODES,
+    Elevator,
+    ElevatorEvent,
+    Event,
+    MotorController,
+)
+from modes import LOADING, MOVING
+from stopqueue import StopQueue
+
+MOTOR_STATES = ("OFF", "ON")
+# (name, struct format) of every field kept per car, widest first so all the
+# fields stay aligned in the shared buffer
+FIELDS = (
+    ("stops", "Q"),
+    ("stops_for_later", "Q"),
+    ("stops_for_after_later", "Q"),
+    ("floor", "i"),
+    ("mode", "B"),
+    ("direction", "B"),
+    ("motor", "B"),
+)
+_ITEM_SIZES = {"Q": 8, "i": 4, "B": 1}
+CAR_BYTES = sum(_ITEM_SIZES[fmt] for _, fmt in FIELDS)
+
+_MODE_INDEX = {mode: i for i, mode in enumerate(MODES)}
+_DIRECTION_INDEX = {direction: i for i, direction in enumerate(DIRECTIONS)}
+_MOTOR_INDEX = {state: i for i, state in enumerate(MOTOR_STATES)}
+
+
+class _QueueView(StopQueue):
+    """A StopQueue whose mask is one car's element of a Fleet array"""
+
+    __slots__ = ("_masks", "_car")
+
+    def __init__(self, masks: memoryview, car: int, offset: int, size: int):
+        self._masks = masks
+        self._car = car
+        self.offset = offset
+        self.size = size
+
+    @property
+    def mask(self) -> int:
+        return self._masks[self._car]
+
+    @mask.setter
+    def mask(self, value: int):
+        self._masks[self._car] = value
+
+
+class _MotorView(MotorController):
+    def __init__(self, motors: memoryview, car: int):
+        self._motors = motors
+        self._car = car
+
+    @property
+    def motor_state(self) -> str:
+        return MOTOR_STATES[self._motors[self._car]]
+
+    @motor_state.setter
+    def motor_state(self, value: str):
+        self._motors[self._car] = _MOTOR_INDEX[value]
+
+
+class CarView(Elevator):
+    """One car of a Fleet, usable wherever an Elevator is
+
+    Reads and writes go straight to the fleet's arrays, so the mode handlers
+    (and `to_code()`, `invariants()`, `handle_event()`...) run against the
+    car unchanged. `copy()` gives a plain, detached Elevator. The undo log
+    belongs to the view, not to the fleet.
+    """
+
+    def __init__(self, fleet: "Fleet", car: int):
+        self.fleet = fleet
+        self.undo_log = []
+        offset, size = fleet.building.bottom_floor, fleet.building.n_floors
+        self.stops = _QueueView(fleet.stops, car, offset, size)
+        self.stops_for_later = _QueueView(fleet.stops_for_later, car, offset, size)
+        self.stops_for_after_later = _QueueView(
+            fleet.stops_for_after_later, car, offset, size
+        )
+        self.motor_controller = _MotorView(fleet.motor, car)
+        self.car = car
+
+    def _seek(self, car: int):
+        """Point the view at another car of the same fleet"""
+        self.car = car
+        self.stops._car = car
+        self.stops_for_later._car = car
+        self.stops_for_after_later._car = car
+        self.motor_controller._car = car
+
+    @property
+    def building(self) -> Building:
+        return self.fleet.building
+
+    @property
+    def mode(self):
+        return MODES[self.fleet.mode[self.car]]
+
+    @mode.setter
+    def mode(self, value):
+        self.fleet.mode[self.car] = _MODE_INDEX[value]
+
+    @property
+    def direction(self):
+        return DIRECTIONS[self.fleet.direction[self.car]]
+
+    @direction.setter
+    def direction(self, value):
+        self.fleet.direction[self.car] = _DIRECTION_INDEX[value]
+
+    @property
+    def current_floor(self) -> int:
+        return self.fleet.floor[self.car]
+
+    @current_floor.setter
+    def current_floor(self, value: int):
+        self.fleet.floor[self.car] = value
+
+    def change_direction(self):
+        assert self.direction in ("UP", "DOWN")
+        self.direction = "UP" if self.direction == "DOWN" else "DOWN"
+        # The queues are tied to their arrays, so rotate the masks instead of
+        # the queue objects
+        stops, later, after_later = (
+            self.stops,
+            self.stops_for_later,
+            self.stops_for_after_later,
+        )
+        stops.mask, later.mask, after_later.mask = later.mask, after_later.mask, 0
+        self.mode = MOVING
+
+
+class Fleet:
+    """The state of many cars of one building, as a struct of arrays
+
+    Every field of every car lives in a single buffer, one contiguous typed
+    array (a memoryview) per field, CAR_BYTES per car in total: stop masks,
+    floor, mode and direction (as indices in MODES and DIRECTIONS) and motor
+    state (as an index in MOTOR_STATES). There are no per-car objects until
+    a CarView is asked for, so a fleet of thousands of cars costs a few
+    dozen bytes each.
+
+    `fleet[i]` is a CarView of car i. Bulk operations go through the arrays,
+    and `snapshot()` copies the whole fleet in one go.
+    """
+
+    def __init__(self, cars: int, building: Building = DEFAULT_BUILDING):
+        if building.n_floors > 64:
+            raise ValueError("A fleet can't store the stops of more than 64 floors")
+        self.building = building
+        self.cars = cars
+        self._buffer = bytearray(cars * CAR_BYTES)
+        buffer = memoryview(self._buffer)
+        start = 0
+        for name, fmt in FIELDS:
+            end = start + cars * _ITEM_SIZES[fmt]
+            setattr(self, name, buffer[start:end].cast(fmt))
+            start = end
+        # Every car starts IDLE (mode 0, direction 0, motor 0) on the lowest
+        # floor it stops at, like a new Elevator
+        self.floor[:] = array("i", [building.lowest_served]) * cars
+
+    def __len__(self):
+        return self.cars
+
+    def __getitem__(self, car: int) -> CarView:
+        if not -self.cars <= car < self.cars:
+            raise IndexError("Car index out of range")
+        return CarView(self, car % self.cars)
+
+    def __iter__(self):
+        for car in range(self.cars):
+            yield CarView(self, car)
+
+    @classmethod
+    def from_elevators(cls, elevators: list[Elevator]) -> "Fleet":
+        """A fleet holding the state of `elevators`, all in the same building"""
+        building = elevators[0].building if elevators else DEFAULT_BUILDING
+        fleet = cls(len(elevators), building)
+        for view, elevator in zip(fleet, elevators):
+            if elevator.building != building:
+                raise ValueError("All the elevators of a fleet share a building")
+            view.set_code(elevator.to_code())
+            view.motor_controller.motor_state = elevator.motor_controller.motor_state
+        return fleet
+
+    def handle_events(self, batch: Iterable[tuple[int, Event | ElevatorEvent]]):
+        """Have each (car, event) of `batch` handled by the mode handlers
+
+        One view is pointed at each car in turn, so no object is created per
+        event. Stops at the first event the handlers reject.
+        """
+        view = CarView(self, 0)
+        for car, event in batch:
+            view._seek(car)
+            view.handle_event(event)
+
+    def apply_floor_sensors(self, cars: Iterable[int] | None = None) -> list[int]:
+        """Every moving car (of `cars`) reaches the next floor in its direction
+
+        The same as sending each one the FLOOR_SENSOR event of that floor, as
+        in MOVING.handle_floor_sensor_input(), but straight on the arrays.
+        Returns the cars that arrived at one of their stops and are loading.
+        """
+        mode, direction, floor = self.mode, self.direction, self.floor
+        stops, motor = self.stops, self.motor
+        moving, loading = _MODE_INDEX[MOVING], _MODE_INDEX[LOADING]
+        up, down = _DIRECTION_INDEX["UP"], _DIRECTION_INDEX["DOWN"]
+        off = _MOTOR_INDEX["OFF"]
+        bottom, top = self.building.bottom_floor, self.building.top_floor
+        arrived = []
+        for car in range(self.cars) if cars is None else cars:
+            if mode[car] != moving:
+                continue
+            if direction[car] == up:
+                new_floor = floor[car] + 1
+            elif direction[car] == down:
+                new_floor = floor[car] - 1
+            else:
+                continue
+            floor[car] = new_floor
+            if bottom <= new_floor <= top:
+                bit = 1 << (new_floor - bottom)
+                if stops[car] & bit:
+                    stops[car] ^= bit
+                    motor[car] = off
+                    mode[car] = loading
+                    arrived.append(car)
+        return arrived
+
+    def snapshot(self) -> bytes:
+        """The state of every car, as one copy of the buffer"""
+        return bytes(self._buffer)
+
+    def snapshot_into(self, buffer):
+        """Copy the state of every car into the start of a writable buffer"""
+        memoryview(buffer)[: len(self._buffer)] = self._buffer
+
+    def restore(self, snapshot):
+        """Put every car back in the state of a `snapshot()` of this fleet"""
+        if len(snapshot) != len(self._buffer):
+            raise ValueError("The snapshot is of a fleet of another size")
+        memoryview(self._buffer)[:] = snapshot
+
+
+if __name__ == "__main__":
+    import random
+    import time
+
+    fleet = Fleet(10_000)
+    # Anything but a call from the floor the cars are on
+    presses = [
+        event
+        for event in fleet.building.button_presses
+        if event.floor != fleet.building.lowest_served
+    ]
+    rng = random.Random(0)
+    start = time.perf_counter()
+    fleet.handle_events((car, rng.choice(presses)) for car in range(len(fleet)))
+    pressed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    steps = arrived = 0
+    while any(fleet.mode[car] == _MODE_INDEX[MOVING] for car in range(len(fleet))):
+        arrived += len(fleet.apply_floor_sensors())
+        steps += 1
+    moved = time.perf_counter() - start
+
+    start = time.perf_counter()
+    snapshot = fleet.snapshot()
+    copied = time.perf_counter() - start
+    print(f"{len(fleet)} cars in {len(snapshot)} bytes ({CAR_BYTES} per car)")
+    print(f"One button press per car in {pressed * 1e3:.1f}ms")
+    print(f"{steps} floor sensor sweeps, {arrived} arrivals in {moved * 1e3:.1f}ms")
+    print(f"Snapshot in {copied * 1e6:.0f}us")
@@ -0,0 +1,255 @@
+import time
+from array import array
+from dataclasses import dataclass, field
+
+from compiled import NO_TRANSITION, TransitionTable
+from elevator import DIRECTIONS, MODES, Elevator, ElevatorEvent, ElevatorState
+from modes import IDLE, MOVING
+
+_MASK64 = (1 << 64) - 1
+_IDLE, _MOVING = MODES.index(IDLE), MODES.index(MOVING)
+_UP, _DOWN = DIRECTIONS.index("UP"), DIRECTIONS.index("DOWN")
+
+
+def _next_random(x: int) -> int:
+    # 64 bit LCG (Knuth's MMIX constants). Good enough to pick buttons, and
+    # cheap enough to keep one per lane
+    return (x * 6364136223846793005 + 1442695040888963407) & _MASK64
+
+
+def lane_seed(seed: int, lane: int) -> int:
+    return (seed * 1_000_003 + lane) & _MASK64
+
+
+class StateFields:
+    """The states of a TransitionTable decoded into struct-of-arrays form
+
+    Index any of the arrays by state id. `bottom` and `top` are the floors
+    of the building of the table.
+    """
+
+    def __init__(self, table: TransitionTable):
+        self.bottom = table.building.bottom_floor
+        self.top = table.building.top_floor
+        self.mode = array("b")
+        self.direction = array("b")
+        self.floor = array("l")
+        self.stops = array("q")
+        self.stops_for_later = array("q")
+        self.stops_for_after_later = array("q")
+        for code in table.codes:
+            elevator = Elevator.from_code(code, table.building)
+            self.mode.append(MODES.index(elevator.mode))
+            self.direction.append(DIRECTIONS.index(elevator.direction))
+            self.floor.append(elevator.current_floor)
+            self.stops.append(elevator.stops.mask)
+            self.stops_for_later.append(elevator.stops_for_later.mask)
+            self.stops_for_after_later.append(elevator.stops_for_after_later.mask)
+
+
+# The rules of Elevator.invariants(), written as predicates over one index of
+# the StateFields arrays so they can be swept over every state at once
+INVARIANTS = [
+    (
+        "IDLE and with stops to fulfil",
+        lambda f, i: f.mode[i] == _IDLE
+        and bool(f.stops[i] | f.stops_for_later[i] | f.stops_for_after_later[i]),
+    ),
+    (
+        "IDLE but with a direction",
+        lambda f, i: f.mode[i] == _IDLE and f.direction[i] != 0,
+    ),
+    ("Went through roof", lambda f, i: f.floor[i] > f.top),
+    ("Went through floor", lambda f, i: f.floor[i] < f.bottom),
+    ("Moving with no stops", lambda f, i: f.mode[i] == _MOVING and not f.stops[i]),
+    (
+        "Moving up and stops for now are below",
+        # No stop above the current floor
+        lambda f, i: f.mode[i] == _MOVING
+        and f.direction[i] == _UP
+        and not f.stops[i] >> (f.floor[i] - f.bottom + 1),
+    ),
+    (
+        "Moving down and stops for now are above",
+        # No stop below the current floor
+        lambda f, i: f.mode[i] == _MOVING
+        and f.direction[i] == _DOWN
+        and not f.stops[i] & ((1 << (f.floor[i] - f.bottom)) - 1),
+    ),
+    (
+        "Moving down from the bottom floor",
+        lambda f, i: f.mode[i] == _MOVING
+        and f.direction[i] == _DOWN
+        and f.floor[i] == f.bottom,
+    ),
+    (
+        "Moving up from the top floor",
+        lambda f, i: f.mode[i] == _MOVING
+        and f.direction[i] == _UP
+        and f.floor[i] == f.top,
+    ),
+    (
+        "The same floor can't be in more than one stop lists",
+        lambda f, i: bool(
+            f.stops[i] & f.stops_for_later[i] & f.stops_for_after_later[i]
+        ),
+    ),
+]
+
+
+@dataclass
+class Failure:
+    lane: int
+    seed: int
+    step: int
+    message: str
+    events: list[ElevatorEvent] = field(repr=False)
+
+
+@dataclass
+class FuzzStats:
+    lanes: int = 0
+    events: int = 0
+    seconds: float = 0.0
+
+    @property
+    def events_per_second(self) -> float:
+        if not self.seconds:
+            return 0.0
+        return self.events / self.seconds
+
+    def __str__(self):
+        return (
+            f"{self.events} events over {self.lanes} lanes in {self.seconds:.2f}s "
+            f"({self.events_per_second:.0f} events/s)"
+        )
+
+
+class BatchFuzzer:
+    """Random walk many elevators in lockstep over a compiled TransitionTable
+
+    This is the "school of 3rd graders" from testing.txt: every step, each
+    lane presses one of the buttons Building.possible_events() offers in its
+    current state (or gets the sensor / loading complete event it is waiting
+    for). Lanes only hold a state id and a random number generator; the
+    invariants are swept over all the table's states once, up front, so
+    checking a lane after a step is a single lookup.
+
+    A lane that breaks an invariant, or gets an event its handlers reject, is
+    retired and reported with its seed. `replay_lane()` turns a seed back
+    into the events that lane saw.
+    """
+
+    def __init__(self, table: TransitionTable):
+        self.table = table
+        self.fields = StateFields(table)
+        self.stats = FuzzStats()
+
+        # Index of the first invariant each state breaks, or -1
+        self.violations = array("b", [-1]) * len(table)
+        for i in range(len(table)):
+            for n, (_, predicate) in enumerate(INVARIANTS):
+                if predicate(self.fields, i):
+                    self.violations[i] = n
+                    break
+
+        # The ids of Building.possible_events() for each state, in CSR form
+        self.event_offsets = array("l", [0])
+        # Unsigned shorts, as tall buildings have more than 127 events
+        self.event_ids = array("H")
+        by_state = {}
+        for i in range(len(table)):
+            state = ElevatorState(
+                mode=MODES[self.fields.mode[i]].__name__,
+                direction=DIRECTIONS[self.fields.direction[i]],
+                current_floor=self.fields.floor[i],
+                building=table.building,
+            )
+            if state not in by_state:
+                # States that already break an invariant can ask for events
+                # outside the table (e.g. a sensor below the bottom floor).
+                # Lanes never step out of those, so leave them out
+                events = table.building.possible_events(state)
+                by_state[state] = array(
+                    "H", (table.event_ids[e] for e in events if e in table.event_ids)
+                )
+            self.event_ids.extend(by_state[state])
+            self.event_offsets.append(len(self.event_ids))
+
+    def _step_lane(self, state_id: int, x: int) -> tuple[int, int, int]:
+        x = _next_random(x)
+        start = self.event_offsets[state_id]
+        count = self.event_offsets[state_id + 1] - start
+        event_id = self.event_ids[start + (x >> 33) % count]
+        return self.table.next_state(state_id, event_id), event_id, x
+
+    def run(
+        self, lanes: int = 1024, steps: int = 1000, seed: int = 0
+    ) -> list[Failure]:
+        self.stats = FuzzStats(lanes=lanes)
+        start = time.perf_counter()
+
+        states = array("l", [0]) * lanes
+        randoms = array("Q", (lane_seed(seed, lane) for lane in range(lanes)))
+        active = list(range(lanes))
+        failures = []
+        # Hoisted out of the hot loop
+        offsets, event_ids = self.event_offsets, self.event_ids
+        targets, n_events = self.table.targets, self.table.n_events
+        violations = self.violations
+
+        for step in range(steps):
+            retired = []
+            for lane in active:
+                state_id = states[lane]
+                x = _next_random(randoms[lane])
+                start_event = offsets[state_id]
+                count = offsets[state_id + 1] - start_event
+                event_id = event_ids[start_event + (x >> 33) % count]
+                new_state_id = targets[state_id * n_events + event_id]
+                randoms[lane] = x
+                states[lane] = new_state_id
+                if new_state_id == NO_TRANSITION or violations[new_state_id] >= 0:
+                    retired.append(lane)
+            self.stats.events += len(active)
+            for lane in retired:
+                active.remove(lane)
+                failures.append(self._failure(seed, lane, step, states[lane]))
+            if not active:
+                break
+
+        self.stats.seconds = time.perf_counter() - start
+        return failures
+
+    def _failure(self, seed: int, lane: int, step: int, state_id: int) -> Failure:
+        if state_id == NO_TRANSITION:
+            message = "Event rejected by the handlers"
+        else:
+            message = INVARIANTS[self.violations[state_id]][0]
+        this_seed = lane_seed(seed, lane)
+        return Failure(
+            lane=lane,
+            seed=this_seed,
+            step=step,
+            message=message,
+            events=self.replay_lane(this_seed, step + 1),
+        )
+
+    def replay_lane(self, seed: int, steps: int) -> list[ElevatorEvent]:
+        """The events a lane starting from `seed` goes through in `steps` steps"""
+        events = []
+        state_id, x = 0, seed
+        for _ in range(steps):
+            state_id, event_id, x = self._step_lane(state_id, x)
+            events.append(self.table.events[event_id])
+            if state_id == NO_TRANSITION:
+                break
+        return events
+
+
+if __name__ == "__main__":
+    fuzzer = BatchFuzzer(TransitionTable.cached())
+    failures = fuzzer.run(lanes=4096, steps=500)
+    print(fuzzer.stats)
+    for failure in failures[:10]:
+        print(failure)
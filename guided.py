@@ -0,0 +1,451 @@
+import argparse
+import hashlib
+import random
+import sys
+import time
+import zlib
+from dataclasses import dataclass, field
+from multiprocessing import Pool, RawArray
+from pathlib import Path
+
+import idle
+import loading
+import moving
+from building import DEFAULT_BUILDING, Building
+from elevator import Elevator, Event
+from fuzzer import lane_seed
+
+HANDLER_FILES = frozenset(module.__file__ for module in (idle, moving, loading))
+# One byte per slot, shared by every worker. Big enough for collisions between
+# the few thousand coverage keys a building has to be rare
+BITMAP_SIZE = 1 << 20
+# The gene that isn't a button press: the floor sensor or loading complete
+# event the car is waiting for, if any. Gene g > 0 is button_presses[g - 1]
+TICK = 0
+
+
+class _ArcTracer:
+    """A sys.settrace() function collecting the arcs run in the handlers
+
+    An arc is a (function, from line, to line) jump, with the negated first
+    line of the function standing for its entry and exit, like coverage.py.
+    Arcs tell apart the branches of an `if` that has no `else`, which lines
+    alone don't.
+    """
+
+    def __init__(self):
+        self.arcs = set()
+
+    def __call__(self, frame, event, arg):
+        code = frame.f_code
+        if code.co_filename not in HANDLER_FILES:
+            return None
+        arcs = self.arcs
+        function = code.co_qualname
+        entry = -code.co_firstlineno
+        last = entry
+
+        def trace_lines(frame, event, arg):
+            nonlocal last
+            if event == "line":
+                arcs.add((function, last, frame.f_lineno))
+                last = frame.f_lineno
+            elif event == "return":
+                arcs.add((function, last, entry))
+            return trace_lines
+
+        return trace_lines
+
+
+@dataclass
+class Run:
+    """What running one input did"""
+
+    # (mode, direction, event kind, function, from line, to line) before each
+    # event, for every arc its handler ran
+    coverage: set
+    # The events actually handled, ticks with nothing to wait for left out
+    events: list[Event]
+    # Genes used, up to and including the one that failed, if any
+    length: int
+    # The invariant broken or the error the handlers raised, if any
+    message: str | None = None
+
+
+def execute(building: Building, genes: bytes) -> Run:
+    """Run `genes` on a new elevator with the handlers traced"""
+    elevator = Elevator(building=building)
+    presses = building.button_presses
+    n_presses = len(presses)
+    dispatch = Elevator.DISPATCH
+    tracer = _ArcTracer()
+    coverage = set()
+    events = []
+    previous_trace = sys.gettrace()
+    for length, gene in enumerate(genes, 1):
+        if gene == TICK:
+            possible = building.possible_events(elevator.state)
+            if len(possible) == n_presses:
+                continue
+            event = possible[n_presses]
+        else:
+            event = presses[gene - 1]
+        events.append(event)
+        mode, direction = elevator.mode.__name__, elevator.direction
+        tracer.arcs.clear()
+        sys.settrace(tracer)
+        try:
+            dispatch[elevator.mode, event.kind](elevator, event)
+            message = None
+        except RuntimeError as e:
+            message = str(e)
+        finally:
+            sys.settrace(previous_trace)
+        kind = event.kind.value
+        coverage.update((mode, direction, kind, *arc) for arc in tracer.arcs)
+        if message is None:
+            try:
+                elevator.invariants()
+            except AssertionError as e:
+                message = str(e)
+        if message is not None:
+            return Run(coverage, events, length, message)
+    return Run(coverage, events, len(genes))
+
+
+def _slot(key: tuple) -> int:
+    # Not hash(), which is salted differently in every process
+    return zlib.crc32(repr(key).encode()) & (BITMAP_SIZE - 1)
+
+
+class _Worker:
+    """Generates, runs and keeps inputs, in one process"""
+
+    def __init__(self, building: Building, bitmap, guided: bool, max_length: int):
+        if len(building.button_presses) >= 256:
+            raise ValueError("Too many buttons in the building to fit a gene")
+        self.building = building
+        self.bitmap = bitmap
+        self.guided = guided
+        self.max_length = max_length
+        self.slots = {}
+
+    def random_genes(self, rng: random.Random, n: int) -> bytes:
+        # Ticks as likely as any one button, as random walks pick them
+        top = len(self.building.button_presses)
+        return bytes(rng.randint(0, top) for _ in range(n))
+
+    def mutate(self, rng: random.Random, corpus: list[bytes]) -> bytes:
+        genes = rng.choice(corpus)
+        mutation = rng.randrange(4)
+        if mutation == 0:
+            # Splice: the start of one input, the end of another
+            other = rng.choice(corpus)
+            genes = (
+                genes[: rng.randint(0, len(genes))]
+                + other[rng.randint(0, len(other)) :]
+            )
+        elif mutation == 1:
+            genes = genes[: rng.randint(0, len(genes))]
+        else:
+            # Insert button presses, or ticks to let the car get somewhere
+            # between them
+            top = len(self.building.button_presses) if mutation == 2 else 0
+            genes = bytearray(genes)
+            for _ in range(rng.randint(1, 4)):
+                genes.insert(rng.randint(0, len(genes)), rng.randint(min(1, top), top))
+            genes = bytes(genes)
+        if rng.random() < 0.5:
+            genes += self.random_genes(rng, rng.randint(1, 8))
+        return genes[: self.max_length]
+
+    def fuzz(self, seed: int, corpus: list[bytes], inputs: int) -> tuple:
+        """Try `inputs` inputs, returning the ones finding new coverage
+
+        Returns them as (genes, coverage, events handled so far), along with
+        the failures as (message, events), and the number of events handled.
+        """
+        rng = random.Random(seed)
+        corpus = list(corpus)
+        bitmap, slots = self.bitmap, self.slots
+        found, failures = [], {}
+        n_events = 0
+        for _ in range(inputs):
+            if self.guided and corpus:
+                genes = self.mutate(rng, corpus)
+            else:
+                genes = self.random_genes(rng, self.max_length)
+            run = execute(self.building, genes)
+            n_events += len(run.events)
+            new = False
+            for key in run.coverage:
+                slot = slots.get(key)
+                if slot is None:
+                    slot = slots[key] = _slot(key)
+                if not bitmap[slot]:
+                    bitmap[slot] = 1
+                    new = True
+            if new:
+                genes = genes[: run.length]
+                corpus.append(genes)
+                found.append((genes, run.coverage, n_events))
+            if run.message is not None:
+                known = failures.get(run.message)
+                if known is None or len(run.events) < len(known):
+                    failures[run.message] = run.events
+        return found, list(failures.items()), n_events
+
+
+_worker: _Worker | None = None
+
+
+def _init_worker(*args):
+    global _worker
+    _worker = _Worker(*args)
+
+
+def _fuzz_round(args):
+    return _worker.fuzz(*args)
+
+
+@dataclass
+class Failure:
+    message: str
+    events: list[Event] = field(repr=False)
+
+
+@dataclass
+class GuidedStats:
+    inputs: int = 0
+    events: int = 0
+    seconds: float = 0.0
+    corpus: int = 0
+    coverage: int = 0
+
+    def __str__(self):
+        return (
+            f"{self.coverage} arcs covered by a corpus of {self.corpus} after "
+            f"{self.inputs} inputs ({self.events} events) in {self.seconds:.2f}s"
+        )
+
+
+class CoverageFuzzer:
+    """Fuzz the handlers, keeping the event sequences that reach new code
+
+    Coverage is the set of (mode, direction, event kind, arc) the handlers of
+    IDLE, MOVING and LOADING run, see `_ArcTracer`. An input is a string of
+    genes, each a button press or a tick letting the car reach the next floor
+    or finish loading. Inputs that reach new coverage join the corpus, and
+    new inputs are mutations of those: splicing two together, truncating one,
+    or inserting button presses or ticks, then maybe appending random genes.
+    With `guided=False` every input is random instead, a uniform random walk
+    over Building.possible_events() like BatchFuzzer's, to compare against.
+
+    With more than one process, each one fuzzes its own copy of the corpus
+    for a round of `round_inputs` inputs, and they tell what is already
+    covered apart through a bitmap in shared memory. The corpus is merged
+    between rounds. `coverage` maps every key covered to the number of
+    events it took to cover it.
+
+    With `corpus_dir` the corpus is loaded from there and the inputs found
+    are saved to it, one file per input. Gene numbers depend on the
+    building, so use one directory per building.
+    """
+
+    def __init__(
+        self,
+        building: Building = DEFAULT_BUILDING,
+        processes: int = 1,
+        guided: bool = True,
+        max_length: int = 32,
+        corpus_dir: Path | None = None,
+    ):
+        self.building = building
+        self.processes = processes
+        self.guided = guided
+        self.max_length = max_length
+        self.corpus_dir = Path(corpus_dir) if corpus_dir is not None else None
+        self.corpus: list[bytes] = []
+        self.coverage: dict[tuple, int] = {}
+        self.failures: dict[str, Failure] = {}
+        self.stats = GuidedStats()
+
+    def _merge(self, found, failures, n_events) -> list[bytes]:
+        new_inputs = []
+        for genes, coverage, events_at in found:
+            new = False
+            for key in coverage:
+                if key not in self.coverage:
+                    self.coverage[key] = self.stats.events + events_at
+                    new = True
+            if new:
+                self.corpus.append(genes)
+                new_inputs.append(genes)
+        for message, events in failures:
+            known = self.failures.get(message)
+            if known is None or len(events) < len(known.events):
+                self.failures[message] = Failure(message, events)
+        self.stats.events += n_events
+        return new_inputs
+
+    def _load_corpus(self, worker: _Worker):
+        if self.corpus_dir is None or not self.corpus_dir.is_dir():
+            return
+        for path in sorted(self.corpus_dir.glob("*.genes")):
+            genes = path.read_bytes()
+            run = execute(self.building, genes)
+            found = [(genes, run.coverage, len(run.events))]
+            self._merge(found, [], len(run.events))
+            for key in run.coverage:
+                worker.bitmap[_slot(key)] = 1
+            self.stats.inputs += 1
+
+    def _save(self, genes: bytes):
+        name = hashlib.sha1(genes).hexdigest()[:16]
+        (self.corpus_dir / f"{name}.genes").write_bytes(genes)
+
+    def run(
+        self,
+        inputs: int = 10_000,
+        seed: int = 0,
+        round_inputs: int = 200,
+        until: set | None = None,
+    ) -> list[Failure]:
+        """Try about `inputs` inputs, or stop as soon as `until` is covered
+
+        Returns one Failure per invariant broken or error raised, with the
+        shortest events found that lead to it.
+        """
+        start = time.perf_counter()
+        if self.processes > 1:
+            bitmap = RawArray("B", BITMAP_SIZE)
+        else:
+            bitmap = bytearray(BITMAP_SIZE)
+        worker_args = (self.building, bitmap, self.guided, self.max_length)
+        worker = _Worker(*worker_args)
+        for key in self.coverage:
+            worker.bitmap[_slot(key)] = 1
+        if self.guided and not self.corpus:
+            self._load_corpus(worker)
+        if self.corpus_dir is not None:
+            self.corpus_dir.mkdir(parents=True, exist_ok=True)
+
+        pool = None
+        if self.processes > 1:
+            pool = Pool(self.processes, _init_worker, worker_args)
+        try:
+            task = 0
+            while self.stats.inputs < inputs:
+                if until is not None and until <= self.coverage.keys():
+                    break
+                corpus = self.corpus if self.guided else []
+                n = min(round_inputs, inputs - self.stats.inputs)
+                if pool is None:
+                    results = [worker.fuzz(lane_seed(seed, task), corpus, n)]
+                    task += 1
+                    self.stats.inputs += n
+                else:
+                    tasks = []
+                    for _ in range(self.processes):
+                        tasks.append((lane_seed(seed, task), corpus, n))
+                        task += 1
+                    results = pool.map(_fuzz_round, tasks)
+                    self.stats.inputs += n * self.processes
+                for result in results:
+                    for genes in self._merge(*result):
+                        if self.corpus_dir is not None:
+                            self._save(genes)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        self.stats.seconds += time.perf_counter() - start
+        self.stats.corpus = len(self.corpus)
+        self.stats.coverage = len(self.coverage)
+        return list(self.failures.values())
+
+    def events_to_cover(self, keys: set) -> int | None:
+        """Events it took to cover all of `keys`, or None if they aren't yet"""
+        if not keys <= self.coverage.keys():
+            return None
+        return max((self.coverage[key] for key in keys), default=0)
+
+
+def reachable_coverage(
+    building: Building, function, mode: str | None = None
+) -> set:
+    """Every coverage key of `function` that a reachable, valid state can hit
+
+    Found by running every event on every state of a full state exploration,
+    so only use it on small buildings.
+    """
+    from explorer import Explorer
+
+    explorer = Explorer(
+        building.possible_events, full_state=True, stop_on_violation=False
+    )
+    codes = explorer.explore(Elevator(building=building))
+    qualname = function.__qualname__
+    tracer = _ArcTracer()
+    keys = set()
+    previous_trace = sys.gettrace()
+    for code in codes:
+        elevator = Elevator.from_code(code, building)
+        if mode is not None and elevator.mode.__name__ != mode:
+            continue
+        try:
+            elevator.invariants()
+        except AssertionError:
+            continue
+        for event in building.possible_events(elevator.state):
+            elevator.push_undo()
+            tracer.arcs.clear()
+            sys.settrace(tracer)
+            try:
+                Elevator.DISPATCH[elevator.mode, event.kind](elevator, event)
+            except RuntimeError:
+                pass
+            finally:
+                sys.settrace(previous_trace)
+            elevator.revert()
+            keys.update(
+                (elevator.mode.__name__, elevator.direction, event.kind.value, *arc)
+                for arc in tracer.arcs
+                if arc[0] == qualname
+            )
+    return keys
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare coverage guided and uniform random fuzzing"
+    )
+    parser.add_argument("--inputs", type=int, default=20_000)
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--corpus", type=Path, default=None, help="directory to keep the corpus in"
+    )
+    args = parser.parse_args()
+
+    target = reachable_coverage(
+        DEFAULT_BUILDING, moving.MOVING.handle_hallway_button_press, mode="MOVING"
+    )
+    print(f"{len(target)} arcs of MOVING.handle_hallway_button_press are reachable")
+    for guided in (True, False):
+        fuzzer = CoverageFuzzer(
+            processes=args.processes,
+            guided=guided,
+            corpus_dir=args.corpus if guided else None,
+        )
+        failures = fuzzer.run(args.inputs, seed=args.seed, until=target)
+        events = fuzzer.events_to_cover(target)
+        covered = len(target & fuzzer.coverage.keys())
+        print(f"{'guided' if guided else 'random'}: {fuzzer.stats}")
+        if events is None:
+            print(f"  {covered}/{len(target)} of them covered")
+        else:
+            print(f"  All of them covered after {events} events")
+        for failure in failures:
+            print(f"  {failure.message} after {len(failure.events)} events")
@@ -1,6 +1,7 @@
 class IDLE:
     @staticmethod
     def handle_onboard_button_press(elev, dest_floor: int):
+        elev.building.check_served(dest_floor)
         # If the current floor button is pressed the elevator doesn't move
         # and opens the doors
         if elev.current_floor == dest_floor:
@@ -13,6 +14,7 @@ class IDLE:
 
     @staticmethod
     def handle_hallway_button_press(elev, floor, direction):
+        elev.building.check_served(floor)
         if elev.current_floor == floor:
             elev.load()
         else:
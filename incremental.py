@@ -0,0 +1,413 @@
+import hashlib
+import inspect
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from dataclasses import dataclass
+from pathlib import Path
+
+import building as building_module
+import elevator as elevator_module
+import events as events_module
+import stopqueue
+from building import DEFAULT_BUILDING, Building
+from compiled import CACHE_DIR, prune_cache
+from elevator import MODES, Elevator, EventKind
+from explorer import StateGraph
+
+_MAGIC = b"ELEVEXP1"
+# Magic, then the length of the JSON metadata that follows
+_HEADER = struct.Struct("<8sq")
+# The method of a mode class handling each kind of event
+HANDLER_NAMES = {
+    EventKind.ONBOARD_PANEL_BUTTON_PRESS: "handle_onboard_button_press",
+    EventKind.FLOOR_SENSOR: "handle_floor_sensor_input",
+    EventKind.HALLWAY_BUTTON_PRESS: "handle_hallway_button_press",
+    EventKind.LOADING_COMPLETE: "handle_loading_complete",
+}
+
+
+def _handler_key(mode, kind: EventKind) -> str:
+    return f"{mode.__name__}.{kind.value}"
+
+
+def handler_fingerprints() -> dict[str, str]:
+    """A hash of the source of every handler, keyed by "MODE.EVENT_KIND"
+
+    Each hash also covers whatever else is in the handler's module (imports,
+    helpers...), so editing that counts as editing every handler of the mode.
+    """
+    fingerprints = {}
+    for mode in MODES:
+        source = inspect.getsource(sys.modules[mode.__module__])
+        handlers = {
+            kind: inspect.getsource(getattr(mode, name))
+            for kind, name in HANDLER_NAMES.items()
+        }
+        rest = source
+        for handler_source in handlers.values():
+            rest = rest.replace(handler_source, "")
+        for kind, handler_source in handlers.items():
+            digest = hashlib.sha256((rest + handler_source).encode())
+            fingerprints[_handler_key(mode, kind)] = digest.hexdigest()[:16]
+    return fingerprints
+
+
+def core_fingerprint(
+    building: Building = DEFAULT_BUILDING, root_code: int = 0
+) -> str:
+    """Hash of what the exploration depends on besides the handlers
+
+    That is the Elevator itself (its methods and invariants), the stop
+    queues, events and building, and where the exploration starts. A change
+    to any of them makes every stored transition suspect. As "<hash of the
+    sources>-<hash of the rest>", like `source_fingerprint()`.
+    """
+    digest = hashlib.sha256()
+    for module in (building_module, elevator_module, events_module, stopqueue):
+        digest.update(Path(module.__file__).read_bytes())
+    start = hashlib.sha256(f"{building!r} {root_code}".encode())
+    return f"{digest.hexdigest()[:16]}-{start.hexdigest()[:16]}"
+
+
+@dataclass
+class IncrementalStats:
+    states: int = 0
+    edges: int = 0
+    # Edges whose handler had to run, the others were taken from the cache
+    handled: int = 0
+    seconds: float = 0.0
+    # "loaded", "updated" or "explored"
+    source: str = "explored"
+
+    def __str__(self):
+        return (
+            f"{self.states} states, {self.edges} edges {self.source} in "
+            f"{self.seconds:.2f}s ({self.handled} edges handled)"
+        )
+
+
+class StoredExploration:
+    """A full state exploration that can be saved, mmapped back and updated
+
+    The states are numbered in BFS order from the root and the edges are in
+    compressed sparse row form, like a StateGraph: the edges out of state `i`
+    go to `targets[offsets[i]:offsets[i + 1]]`, for the events of
+    `building.all_events` in `events_by_edge`. `verdicts[i]` is 0 for states
+    that pass the invariants, and k for the ones breaking `messages[k - 1]`.
+    Those are never expanded, as with `Explorer(stop_on_violation=False)`.
+
+    `handlers` holds the `handler_fingerprints()` the exploration was made
+    with, so `explore()` knows which of its transitions it can reuse.
+    """
+
+    def __init__(
+        self,
+        building: Building,
+        codes,
+        offsets,
+        targets,
+        events_by_edge,
+        verdicts,
+        messages: list[str],
+        handlers: dict[str, str],
+    ):
+        self.building = building
+        self.codes = codes
+        self.offsets = offsets
+        self.targets = targets
+        self.events_by_edge = events_by_edge
+        self.verdicts = verdicts
+        self.messages = messages
+        self.handlers = handlers
+        self.stats = IncrementalStats(len(codes), len(targets))
+        self._mmap = None
+        self._view = None
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Unmap a loaded exploration
+
+        Its arrays (and those of any `graph()` of it) can't be used after
+        that. Does nothing for an exploration that wasn't loaded.
+        """
+        if self._mmap is None:
+            return
+        for values in (
+            self.codes,
+            self.offsets,
+            self.targets,
+            self.events_by_edge,
+            self.verdicts,
+        ):
+            values.release()
+        self._view.release()
+        self._mmap.close()
+        self._mmap = self._view = None
+
+    @property
+    def n_violating(self) -> int:
+        return sum(1 for verdict in self.verdicts if verdict)
+
+    def edges(self, state_id: int):
+        """(target, event id) for every edge out of `state_id`"""
+        start, end = self.offsets[state_id], self.offsets[state_id + 1]
+        return zip(self.targets[start:end], self.events_by_edge[start:end])
+
+    def violation(self, state_id: int) -> str | None:
+        verdict = self.verdicts[state_id]
+        return self.messages[verdict - 1] if verdict else None
+
+    def graph(self) -> StateGraph:
+        """The exploration as a StateGraph, sharing the arrays"""
+        return StateGraph.from_csr(
+            self.codes,
+            list(self.building.all_events),
+            self.offsets,
+            self.targets,
+            self.events_by_edge,
+            self.verdicts,
+            self.building,
+        )
+
+    @classmethod
+    def explore(
+        cls, root: Elevator, previous: "StoredExploration | None" = None
+    ) -> "StoredExploration":
+        """Explore everything reachable from `root`, reusing `previous`
+
+        `previous` has to be an exploration from the same root with the same
+        `core_fingerprint()`. Its transitions are reused for every handler
+        whose fingerprint hasn't changed, and so are its verdicts, which only
+        depend on the state. Only the edges of the handlers that changed run
+        again, and only the states they newly reach are explored from scratch.
+        The result is the same as exploring without `previous`.
+        """
+        start = time.perf_counter()
+        building = root.building
+        events = building.all_events
+        event_ids = {event: i for i, event in enumerate(events)}
+        handlers = handler_fingerprints()
+        dispatch = Elevator.DISPATCH
+
+        if previous is None:
+            changed = set(handlers)
+            old_ids = {}
+            old_codes = old_verdicts = None
+        else:
+            changed = {
+                key
+                for key, fingerprint in handlers.items()
+                if previous.handlers.get(key) != fingerprint
+            }
+            old_codes, old_verdicts = previous.codes, previous.verdicts
+            old_ids = {code: i for i, code in enumerate(old_codes)}
+        # Whether the handler changed, by mode id and then event id
+        stale = [
+            bytearray(_handler_key(mode, event.kind) in changed for event in events)
+            for mode in MODES
+        ]
+
+        messages = []
+        message_ids = {}
+
+        def verdict_of(elevator: Elevator, code: int) -> int:
+            old = old_ids.get(code)
+            if old is not None:
+                verdict = old_verdicts[old]
+                if not verdict:
+                    return 0
+                message = previous.messages[verdict - 1]
+            else:
+                try:
+                    elevator.invariants()
+                    return 0
+                except AssertionError as e:
+                    message = str(e)
+            if message not in message_ids:
+                messages.append(message)
+                message_ids[message] = len(messages)
+            return message_ids[message]
+
+        root_code = root.to_code()
+        codes = array("q", [root_code])
+        ids = {root_code: 0}
+        verdicts = bytearray([verdict_of(root, root_code)])
+        offsets = array("q", [0])
+        targets = array("i")
+        events_by_edge = array("h")
+        handled = 0
+
+        state_id = 0
+        while state_id < len(codes):
+            code = codes[state_id]
+            if not verdicts[state_id]:
+                stale_events = stale[code & 0b11]
+                elevator = None
+                old = old_ids.get(code)
+                if old is not None:
+                    edges = previous.edges(old)
+                else:
+                    # Never seen before, so every edge is new
+                    elevator = Elevator.from_code(code, building)
+                    edges = (
+                        (None, event_ids[event])
+                        for event in building.possible_events(elevator.state)
+                    )
+                for old_target, event_id in edges:
+                    if old_target is not None and not stale_events[event_id]:
+                        new_code = old_codes[old_target]
+                        if new_code not in ids:
+                            ids[new_code] = len(codes)
+                            codes.append(new_code)
+                            verdicts.append(verdict_of(None, new_code))
+                    else:
+                        if elevator is None:
+                            elevator = Elevator.from_code(code, building)
+                        event = events[event_id]
+                        elevator.push_undo()
+                        try:
+                            dispatch[elevator.mode, event.kind](elevator, event)
+                            handled += 1
+                            new_code = elevator.to_code()
+                            if new_code not in ids:
+                                ids[new_code] = len(codes)
+                                codes.append(new_code)
+                                verdicts.append(verdict_of(elevator, new_code))
+                        finally:
+                            elevator.revert()
+                    targets.append(ids[new_code])
+                    events_by_edge.append(event_id)
+            offsets.append(len(targets))
+            state_id += 1
+
+        exploration = cls(
+            building,
+            codes,
+            offsets,
+            targets,
+            events_by_edge,
+            verdicts,
+            messages,
+            handlers,
+        )
+        exploration.stats.handled = handled
+        exploration.stats.seconds = time.perf_counter() - start
+        exploration.stats.source = "explored" if previous is None else "updated"
+        return exploration
+
+    def save(self, path: Path):
+        """Write the exploration to `path`, atomically"""
+        metadata = json.dumps(
+            {
+                "building": repr(self.building),
+                "messages": self.messages,
+                "handlers": self.handlers,
+                "states": len(self.codes),
+                "edges": len(self.targets),
+            }
+        ).encode()
+        tmp = Path(f"{path}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, len(metadata)))
+            f.write(metadata)
+            for values in (
+                self.codes,
+                self.offsets,
+                self.targets,
+                self.events_by_edge,
+                self.verdicts,
+            ):
+                # Keep every array aligned for the casts in `load()`
+                f.write(bytes(-f.tell() % 8))
+                f.write(memoryview(values).cast("B"))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(
+        cls, path: Path, building: Building = DEFAULT_BUILDING
+    ) -> "StoredExploration":
+        """Map a saved exploration into memory, without reading the arrays"""
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, size = _HEADER.unpack_from(buffer)
+        if magic != _MAGIC:
+            buffer.close()
+            raise ValueError(f"{path} is not a stored exploration")
+        metadata = json.loads(buffer[_HEADER.size : _HEADER.size + size])
+        if metadata["building"] != repr(building):
+            buffer.close()
+            raise ValueError(f"{path} is an exploration of another building")
+
+        view = memoryview(buffer)
+        position = _HEADER.size + size
+        arrays = []
+        n_states, n_edges = metadata["states"], metadata["edges"]
+        for fmt, length in (
+            ("q", n_states),
+            ("q", n_states + 1),
+            ("i", n_edges),
+            ("h", n_edges),
+            ("B", n_states),
+        ):
+            position += -position % 8
+            end = position + length * struct.calcsize(fmt)
+            arrays.append(view[position:end].cast(fmt))
+            position = end
+        exploration = cls(
+            building, *arrays, metadata["messages"], metadata["handlers"]
+        )
+        exploration._mmap = buffer
+        exploration._view = view
+        exploration.stats.source = "loaded"
+        return exploration
+
+
+def explore_cached(
+    root: Elevator | None = None, cache_dir: Path = CACHE_DIR
+) -> StoredExploration:
+    """The full state exploration from `root`, from the cache when possible
+
+    The cache file is keyed by `core_fingerprint()`. If the handlers are the
+    same as when it was saved, it is just mapped into memory. If some changed,
+    the stored exploration is updated for them and saved again. Saving one
+    deletes the explorations of older sources.
+    """
+    start = time.perf_counter()
+    root = root or Elevator()
+    fingerprint = core_fingerprint(root.building, root.to_code())
+    path = Path(cache_dir) / f"exploration-{fingerprint}.bin"
+    previous = None
+    if path.exists():
+        previous = StoredExploration.load(path, root.building)
+        if previous.handlers == handler_fingerprints():
+            previous.stats.seconds = time.perf_counter() - start
+            return previous
+    try:
+        exploration = StoredExploration.explore(root, previous)
+    finally:
+        if previous is not None:
+            previous.close()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    exploration.save(path)
+    prune_cache(cache_dir, "exploration", fingerprint)
+    exploration.stats.seconds = time.perf_counter() - start
+    return exploration
+
+
+if __name__ == "__main__":
+    exploration = explore_cached()
+    print(exploration.stats)
+    print(f"{exploration.n_violating} states break an invariant")
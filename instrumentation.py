@@ -0,0 +1,234 @@
+import time
+from array import array
+
+from elevator import Elevator, EventKind, MotorController
+
+# Every power of two is split into 2 ** (SUB_BUCKET_BITS - 1) buckets, so a
+# bucket is never more than 1 / 2 ** (SUB_BUCKET_BITS - 1) wider than its
+# lower bound. Values below 2 ** SUB_BUCKET_BITS get a bucket each.
+SUB_BUCKET_BITS = 4
+_HALF = 1 << (SUB_BUCKET_BITS - 1)
+# Enough buckets for any 64 bit value
+_N_BUCKETS = (64 - SUB_BUCKET_BITS + 1) * _HALF + (1 << SUB_BUCKET_BITS)
+
+
+def _bucket(value: int) -> int:
+    exponent = value.bit_length() - SUB_BUCKET_BITS
+    if exponent <= 0:
+        return value
+    return exponent * _HALF + (value >> exponent)
+
+
+def _bucket_bounds(bucket: int) -> tuple[int, int]:
+    """The values in a bucket, as [low, high)"""
+    if bucket < 1 << SUB_BUCKET_BITS:
+        return bucket, bucket + 1
+    exponent, offset = divmod(bucket - (1 << SUB_BUCKET_BITS), _HALF)
+    exponent += 1
+    mantissa = offset + _HALF
+    return mantissa << exponent, (mantissa + 1) << exponent
+
+
+class LatencyHistogram:
+    """Nanosecond latencies in logarithmic buckets, HDR histogram style
+
+    Recording a value is an array increment, whatever the value. Quantiles
+    are exact up to the width of a bucket (12.5% of the value).
+    """
+
+    def __init__(self):
+        self.counts = array("q", [0]) * _N_BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, nanoseconds: int):
+        self.counts[_bucket(nanoseconds)] += 1
+        self.count += 1
+        self.total += nanoseconds
+        if nanoseconds > self.max:
+            self.max = nanoseconds
+
+    def quantile(self, q: float) -> int:
+        """Upper bound of the bucket holding the `q` quantile"""
+        if not self.count:
+            return 0
+        rank = q * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(_bucket_bounds(bucket)[1], self.max)
+        return self.max
+
+    def buckets(self):
+        """(upper bound, count) for every non-empty bucket, in order"""
+        for bucket, count in enumerate(self.counts):
+            if count:
+                yield _bucket_bounds(bucket)[1], count
+
+
+class Instrumentation:
+    """Count and time what the controller does, only while enabled
+
+    Enabling it swaps every entry of `Elevator.DISPATCH` for a wrapper timing
+    the handler, and `MotorController.move/stop` for versions that count the
+    calls. Disabling it puts the originals back, so an elevator that isn't
+    being instrumented runs exactly the same code as before.
+
+    The swap is global, so it covers every Elevator in the process: the
+    explorer (run it with `processes=1`, the workers keep their own counts)
+    as well as a live ControllerRuntime or Simulation. Only one
+    Instrumentation can be enabled at a time. Use it as a context manager,
+    or call `enable()` and `disable()`.
+    """
+
+    _enabled: "Instrumentation | None" = None
+
+    def __init__(self):
+        self.reset()
+        self._original_dispatch = None
+        self._original_motor = None
+
+    def reset(self):
+        # (mode name, event kind): histogram of the handler's latency
+        self.latency: dict[tuple[str, str], LatencyHistogram] = {}
+        # (mode name before, mode name after): number of events
+        self.transitions: dict[tuple[str, str], int] = {}
+        self.motor = {"move": 0, "stop": 0}
+
+    def _timed(self, key: tuple, handler):
+        mode, kind = key
+        histogram = self.latency.setdefault(
+            (mode.__name__, EventKind(kind).value), LatencyHistogram()
+        )
+        transitions = self.transitions
+        clock = time.perf_counter_ns
+
+        def timed(elev, event):
+            start = clock()
+            try:
+                handler(elev, event)
+            finally:
+                histogram.record(clock() - start)
+            if elev.mode is not mode:
+                transition = (mode.__name__, elev.mode.__name__)
+                transitions[transition] = transitions.get(transition, 0) + 1
+
+        return timed
+
+    def enable(self):
+        if Instrumentation._enabled is self:
+            return
+        if Instrumentation._enabled is not None:
+            raise RuntimeError("Another Instrumentation is already enabled")
+        Instrumentation._enabled = self
+
+        dispatch = Elevator.DISPATCH
+        self._original_dispatch = dict(dispatch)
+        # Update the table in place, since it is shared by reference
+        for key, handler in self._original_dispatch.items():
+            dispatch[key] = self._timed(key, handler)
+
+        move, stop = MotorController.move, MotorController.stop
+        self._original_motor = (move, stop)
+        motor = self.motor
+
+        def counted_move(controller, direction):
+            motor["move"] += 1
+            move(controller, direction)
+
+        def counted_stop(controller):
+            motor["stop"] += 1
+            stop(controller)
+
+        MotorController.move = counted_move
+        MotorController.stop = counted_stop
+
+    def disable(self):
+        if Instrumentation._enabled is not self:
+            return
+        Elevator.DISPATCH.update(self._original_dispatch)
+        MotorController.move, MotorController.stop = self._original_motor
+        self._original_dispatch = self._original_motor = None
+        Instrumentation._enabled = None
+
+    def __enter__(self) -> "Instrumentation":
+        self.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.disable()
+
+    def snapshot(self) -> dict:
+        """Everything recorded so far, as plain (JSON friendly) data"""
+        handlers = {}
+        for (mode, kind), histogram in sorted(self.latency.items()):
+            if not histogram.count:
+                continue
+            handlers.setdefault(mode, {})[kind] = {
+                "calls": histogram.count,
+                "total_ns": histogram.total,
+                "mean_ns": histogram.total / histogram.count,
+                "p50_ns": histogram.quantile(0.5),
+                "p99_ns": histogram.quantile(0.99),
+                "max_ns": histogram.max,
+            }
+        return {
+            "handlers": handlers,
+            "mode_transitions": {
+                f"{before}->{after}": count
+                for (before, after), count in sorted(self.transitions.items())
+            },
+            "motor": dict(self.motor),
+        }
+
+    def prometheus(self, prefix: str = "elevator") -> str:
+        """Everything recorded so far, in the Prometheus text format"""
+        lines = [
+            f"# HELP {prefix}_handler_seconds Time spent handling an event",
+            f"# TYPE {prefix}_handler_seconds histogram",
+        ]
+        for (mode, kind), histogram in sorted(self.latency.items()):
+            if not histogram.count:
+                continue
+            labels = f'mode="{mode}",event="{kind}"'
+            cumulative = 0
+            for upper, count in histogram.buckets():
+                cumulative += count
+                lines.append(
+                    f'{prefix}_handler_seconds_bucket{{{labels},le="{upper / 1e9:g}"}}'
+                    f" {cumulative}"
+                )
+            lines += [
+                f'{prefix}_handler_seconds_bucket{{{labels},le="+Inf"}} '
+                f"{histogram.count}",
+                f"{prefix}_handler_seconds_sum{{{labels}}} {histogram.total / 1e9:g}",
+                f"{prefix}_handler_seconds_count{{{labels}}} {histogram.count}",
+            ]
+        lines += [
+            f"# HELP {prefix}_mode_transitions_total Events that changed the mode",
+            f"# TYPE {prefix}_mode_transitions_total counter",
+        ]
+        for (before, after), count in sorted(self.transitions.items()):
+            lines.append(
+                f'{prefix}_mode_transitions_total{{from="{before}",to="{after}"}} '
+                f"{count}"
+            )
+        lines += [
+            f"# HELP {prefix}_motor_commands_total Calls to the motor controller",
+            f"# TYPE {prefix}_motor_commands_total counter",
+        ]
+        for command, count in self.motor.items():
+            lines.append(
+                f'{prefix}_motor_commands_total{{command="{command}"}} {count}'
+            )
+        return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    from testing import evolve_elevator
+
+    with Instrumentation() as instrumentation:
+        evolve_elevator(Elevator(), set())
+    print(instrumentation.prometheus(), end="")
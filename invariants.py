@@ -0,0 +1,244 @@
+import time
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import Callable
+
+from elevator import Elevator, ElevatorEvent, ElevatorState, Event, as_event
+from modes import IDLE, MOVING
+
+# The fields of an Elevator the invariants read, in snapshot order
+FIELDS = (
+    "mode",
+    "direction",
+    "current_floor",
+    "stops",
+    "stops_for_later",
+    "stops_for_after_later",
+)
+
+
+class Tier(IntEnum):
+    # Cheap enough to run after every event
+    ALWAYS = 0
+    # Run after one in every `sample_every` events
+    SAMPLED = 1
+    # Only run when the engine is in debug mode
+    DEBUG = 2
+
+
+@dataclass(frozen=True)
+class Invariant:
+    name: str
+    tier: Tier
+    # Names from FIELDS that `broken` reads
+    fields: tuple[str, ...]
+    broken: Callable[[Elevator], bool]
+
+    @property
+    def field_mask(self) -> int:
+        return sum(1 << FIELDS.index(name) for name in self.fields)
+
+
+@dataclass
+class Violation:
+    invariant: str
+    tier: Tier
+    state: ElevatorState
+    # None for a car outside its building, which has no code
+    code: int | None
+    event: Event | None = None
+
+
+@dataclass
+class Cost:
+    calls: int = 0
+    nanoseconds: int = 0
+
+
+# The same rules as Elevator.invariants()
+INVARIANTS = [
+    Invariant(
+        "Went through roof",
+        Tier.ALWAYS,
+        ("current_floor",),
+        lambda elev: elev.current_floor > elev.building.top_floor,
+    ),
+    Invariant(
+        "Went through floor",
+        Tier.ALWAYS,
+        ("current_floor",),
+        lambda elev: elev.current_floor < elev.building.bottom_floor,
+    ),
+    Invariant(
+        "Moving down from the bottom floor",
+        Tier.ALWAYS,
+        ("mode", "direction", "current_floor"),
+        lambda elev: elev.mode == MOVING
+        and elev.direction == "DOWN"
+        and elev.current_floor == elev.building.bottom_floor,
+    ),
+    Invariant(
+        "Moving up from the top floor",
+        Tier.ALWAYS,
+        ("mode", "direction", "current_floor"),
+        lambda elev: elev.mode == MOVING
+        and elev.direction == "UP"
+        and elev.current_floor == elev.building.top_floor,
+    ),
+    Invariant(
+        "IDLE but with a direction",
+        Tier.ALWAYS,
+        ("mode", "direction"),
+        lambda elev: elev.mode == IDLE and elev.direction is not None,
+    ),
+    Invariant(
+        "IDLE and with stops to fulfil",
+        Tier.SAMPLED,
+        ("mode", "stops", "stops_for_later", "stops_for_after_later"),
+        lambda elev: elev.mode == IDLE
+        and bool(
+            elev.stops.mask
+            | elev.stops_for_later.mask
+            | elev.stops_for_after_later.mask
+        ),
+    ),
+    Invariant(
+        "Moving with no stops",
+        Tier.SAMPLED,
+        ("mode", "stops"),
+        lambda elev: elev.mode == MOVING and not elev.stops,
+    ),
+    Invariant(
+        "Moving up and stops for now are below",
+        Tier.SAMPLED,
+        ("mode", "direction", "current_floor", "stops"),
+        lambda elev: elev.mode == MOVING
+        and elev.direction == "UP"
+        and bool(elev.stops)
+        and elev.stops.max() <= elev.current_floor,
+    ),
+    Invariant(
+        "Moving down and stops for now are above",
+        Tier.SAMPLED,
+        ("mode", "direction", "current_floor", "stops"),
+        lambda elev: elev.mode == MOVING
+        and elev.direction == "DOWN"
+        and bool(elev.stops)
+        and elev.stops.min() >= elev.current_floor,
+    ),
+    Invariant(
+        "The same floor can't be in more than one stop lists",
+        Tier.DEBUG,
+        ("stops", "stops_for_later", "stops_for_after_later"),
+        lambda elev: bool(
+            elev.stops.mask
+            & elev.stops_for_later.mask
+            & elev.stops_for_after_later.mask
+        ),
+    ),
+]
+
+
+def _snapshot(elev: Elevator) -> tuple:
+    return (
+        elev.mode,
+        elev.direction,
+        elev.current_floor,
+        elev.stops.mask,
+        elev.stops_for_later.mask,
+        elev.stops_for_after_later.mask,
+    )
+
+
+class InvariantEngine:
+    """Check invariants after each event, paying only for what can have broken
+
+    `handle_event()` compares the fields of the elevator before and after the
+    event and only evaluates the invariants reading a field that changed.
+    Of those, ALWAYS invariants always run, SAMPLED ones run on one event in
+    `sample_every`, and DEBUG ones only run with `debug=True`. Fields changed
+    by the events in between are remembered, so a sampled check still looks
+    at whatever they could have broken.
+
+    Broken invariants are returned (and kept in `violations`) as Violation
+    records instead of raising. `costs` counts how often each invariant ran
+    and how long it took.
+    """
+
+    def __init__(
+        self,
+        invariants: list[Invariant] | None = None,
+        sample_every: int = 100,
+        debug: bool = False,
+    ):
+        if sample_every <= 0:
+            raise ValueError("sample_every has to be at least 1")
+        self.invariants = INVARIANTS if invariants is None else invariants
+        self.sample_every = sample_every
+        self.debug = debug
+        self.events = 0
+        self.violations: list[Violation] = []
+        self.costs = {invariant.name: Cost() for invariant in self.invariants}
+        self._field_masks = [invariant.field_mask for invariant in self.invariants]
+        # Fields changed since the SAMPLED invariants last ran
+        self._dirty = 0
+
+    def check(
+        self, elev: Elevator, changed: int = -1, event: Event | None = None
+    ) -> list[Violation]:
+        """Evaluate the invariants reading any of the `changed` fields
+
+        `changed` is a bitmask of indexes into FIELDS, all of them by default.
+        SAMPLED invariants also see the fields changed since they last ran.
+        """
+        if self.debug or self.events % self.sample_every == 0:
+            sampled, self._dirty = changed | self._dirty, 0
+        else:
+            sampled, self._dirty = 0, self._dirty | changed
+        masks = {
+            Tier.ALWAYS: changed,
+            Tier.SAMPLED: sampled,
+            Tier.DEBUG: changed if self.debug else 0,
+        }
+        violations = []
+        for invariant, field_mask in zip(self.invariants, self._field_masks):
+            if not field_mask & masks[invariant.tier]:
+                continue
+            cost = self.costs[invariant.name]
+            start = time.perf_counter_ns()
+            broken = invariant.broken(elev)
+            cost.nanoseconds += time.perf_counter_ns() - start
+            cost.calls += 1
+            if broken:
+                violations.append(
+                    Violation(
+                        invariant=invariant.name,
+                        tier=invariant.tier,
+                        state=elev.state,
+                        code=(
+                            elev.to_code()
+                            if elev.current_floor in elev.building.floors
+                            else None
+                        ),
+                        event=event,
+                    )
+                )
+        self.violations.extend(violations)
+        return violations
+
+    def handle_event(
+        self, elev: Elevator, event: Event | ElevatorEvent
+    ) -> list[Violation]:
+        """Have `elev` handle `event`, then check what the event could break"""
+        event = as_event(event)
+        before = _snapshot(elev)
+        elev.handle_event(event)
+        self.events += 1
+        after = _snapshot(elev)
+        changed = 0
+        for i, (old, new) in enumerate(zip(before, after)):
+            if old != new:
+                changed |= 1 << i
+        if not changed and not self._dirty:
+            return []
+        return self.check(elev, changed, event)
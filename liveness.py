@@ -0,0 +1,217 @@
+from array import array
+from collections import deque
+from dataclasses import dataclass, field
+
+from elevator import Elevator, Event, EventKind
+from explorer import Explorer, StateGraph
+from modes import LOADING
+
+# Events that mean time went by and the car did something. A cycle made only
+# of button presses is just someone pressing buttons faster than the car
+# moves, so it doesn't count as starving anyone
+PROGRESS_KINDS = (EventKind.FLOOR_SENSOR, EventKind.LOADING_COMPLETE)
+
+
+def strongly_connected_components(
+    graph: StateGraph, allowed: bytearray
+) -> tuple[array, int]:
+    """Tarjan's algorithm on the subgraph of states where `allowed` is set
+
+    Iterative, with the call stack kept in two arrays, so it works on graphs
+    of any depth. Returns the component of every state (-1 for states that
+    aren't allowed) and the number of components.
+    """
+    n = len(graph)
+    offsets, targets = graph.offsets, graph.targets
+    index = array("l", [-1]) * n
+    low = array("l", [0]) * n
+    component = array("l", [-1]) * n
+    on_stack = bytearray(n)
+    stack = array("l")
+    call_nodes = array("l")
+    call_positions = array("q")
+    counter = 0
+    n_components = 0
+
+    for root in range(n):
+        if not allowed[root] or index[root] != -1:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = 1
+        call_nodes.append(root)
+        call_positions.append(offsets[root])
+        while call_nodes:
+            v = call_nodes[-1]
+            position = call_positions[-1]
+            if position < offsets[v + 1]:
+                call_positions[-1] = position + 1
+                w = targets[position]
+                if not allowed[w]:
+                    continue
+                if index[w] == -1:
+                    index[w] = low[w] = counter
+                    counter += 1
+                    stack.append(w)
+                    on_stack[w] = 1
+                    call_nodes.append(w)
+                    call_positions.append(offsets[w])
+                elif on_stack[w] and index[w] < low[v]:
+                    low[v] = index[w]
+                continue
+            call_nodes.pop()
+            call_positions.pop()
+            if call_nodes and low[v] < low[call_nodes[-1]]:
+                low[call_nodes[-1]] = low[v]
+            if low[v] == index[v]:
+                while True:
+                    w = stack.pop()
+                    on_stack[w] = 0
+                    component[w] = n_components
+                    if w == v:
+                        break
+                n_components += 1
+    return component, n_components
+
+
+def _shortest_paths(graph: StateGraph, source: int, allowed=None) -> tuple:
+    """BFS parent pointers (state and event id) from `source`, -1 if unreached"""
+    n = len(graph)
+    parent = array("l", [-1]) * n
+    parent_event = array("h", [-1]) * n
+    parent[source] = source
+    queue = deque([source])
+    while queue:
+        v = queue.popleft()
+        for w, event_id in graph.edges(v):
+            if parent[w] == -1 and (allowed is None or allowed(w)):
+                parent[w] = v
+                parent_event[w] = event_id
+                queue.append(w)
+    return parent, parent_event
+
+
+def _path(graph: StateGraph, parents: tuple, source: int, target: int) -> list:
+    parent, parent_event = parents
+    events = []
+    while target != source:
+        events.append(graph.events[parent_event[target]])
+        target = parent[target]
+    events.reverse()
+    return events
+
+
+@dataclass
+class Starvation:
+    """A way to keep the car busy forever without ever stopping at `floor`
+
+    Run `prefix` from the root of the exploration, then repeat `cycle` as
+    often as you like: `floor` stays requested the whole time and the car
+    keeps moving, but it never loads at `floor`.
+    """
+
+    floor: int
+    states: int
+    prefix: list[Event] = field(repr=False)
+    cycle: list[Event] = field(repr=False)
+
+
+def waiting_states(graph: StateGraph) -> dict[int, bytearray]:
+    """For every floor, the states where it is requested and not being served
+
+    That is, the states that pass the invariants, have the floor in one of
+    their stop lists, and aren't loading at it. `graph` has to come from a
+    full state exploration.
+    """
+    n = len(graph)
+    building = graph.building
+    pending = array("q", [0]) * n
+    # Below the building for the states that aren't loading anywhere
+    not_loading = building.bottom_floor - 1
+    loading_at = array("l", [not_loading]) * n
+    for i, code in enumerate(graph.keys):
+        if graph.violating[i]:
+            continue
+        elevator = Elevator.from_code(code, building)
+        pending[i] = (
+            elevator.stops.mask
+            | elevator.stops_for_later.mask
+            | elevator.stops_for_after_later.mask
+        )
+        if elevator.mode == LOADING:
+            loading_at[i] = elevator.current_floor
+
+    waiting = {}
+    for floor in building.floors:
+        bit = 1 << (floor - building.bottom_floor)
+        waiting[floor] = bytearray(
+            not graph.violating[i]
+            and bool(pending[i] & bit)
+            and loading_at[i] != floor
+            for i in range(n)
+        )
+    return waiting
+
+
+def find_starvation(graph: StateGraph) -> list[Starvation]:
+    """One Starvation per floor that can be requested and then never served
+
+    `graph` has to come from a full state exploration, kept with
+    `keep_graph=True`.
+    """
+    n = len(graph)
+    progress = bytearray(event.kind in PROGRESS_KINDS for event in graph.events)
+
+    from_root = None
+    findings = []
+    for floor, allowed in waiting_states(graph).items():
+        component, _ = strongly_connected_components(graph, allowed)
+
+        # Find the progress edge inside a component that is closest to the root
+        best = None
+        for v in range(n):
+            if component[v] == -1:
+                continue
+            for w, event_id in graph.edges(v):
+                if component[w] == component[v] and progress[event_id]:
+                    if from_root is None:
+                        from_root = _shortest_paths(graph, 0)
+                    prefix = _path(graph, from_root, 0, v)
+                    if best is None or len(prefix) < len(best[0]):
+                        best = (prefix, v, w, event_id)
+                    break
+        if best is None:
+            continue
+
+        prefix, v, w, event_id = best
+        scc = component[v]
+        # Close the cycle: take the progress edge, then the shortest way back
+        back = _shortest_paths(graph, w, allowed=lambda s: component[s] == scc)
+        cycle = [graph.events[event_id]] + _path(graph, back, w, v)
+        findings.append(
+            Starvation(
+                floor=floor,
+                states=sum(1 for c in component if c == scc),
+                prefix=prefix,
+                cycle=cycle,
+            )
+        )
+    return findings
+
+
+if __name__ == "__main__":
+    from testing import get_possible_events
+
+    explorer = Explorer(
+        get_possible_events, full_state=True, stop_on_violation=False, keep_graph=True
+    )
+    explorer.explore(Elevator())
+    print(explorer.stats)
+    findings = find_starvation(explorer.graph)
+    if not findings:
+        print("No floor can be starved")
+    for starvation in findings:
+        print(starvation)
+        print("  prefix:", starvation.prefix)
+        print("  cycle: ", starvation.cycle)
@@ -1,6 +1,7 @@
 class LOADING:
     @staticmethod
     def handle_onboard_button_press(elev, dest_floor: int):
+        elev.building.check_served(dest_floor)
         # The below has quite a lot of repetition
         if elev.direction == "UP":
             # If destination is in the direction of movement we will stop there.
@@ -25,6 +26,7 @@ class LOADING:
 
     @staticmethod
     def handle_hallway_button_press(elev, floor, direction):
+        elev.building.check_served(floor)
         # If called from the current floor we open the doors
         if floor == elev.current_floor:
             elev.load()
@@ -32,12 +34,12 @@ class LOADING:
         # unless it can be our lowest or highest stop
         if elev.direction != direction:
             if elev.direction == "UP":
-                if not elev.stops or floor >= max(elev.stops):
+                if not elev.stops or floor >= elev.stops.max():
                     elev.stops.add(floor)
                 else:
                     elev.stops_for_later.add(floor)
             if elev.direction == "DOWN":
-                if not elev.stops or floor <= min(elev.stops):
+                if not elev.stops or floor <= elev.stops.min():
                     elev.stops.add(floor)
                 else:
                     elev.stops_for_later.add(floor)
@@ -52,12 +54,12 @@ class LOADING:
             # unless it can be our lowest or highest stop for later
             else:
                 if elev.direction == "UP":
-                    if not elev.stops_for_later or floor >= max(elev.stops_for_later):
+                    if not elev.stops_for_later or floor >= elev.stops_for_later.max():
                         elev.stops_for_later.add(floor)
                     else:
                         elev.stops_for_after_later.add(floor)
                 if elev.direction == "DOWN":
-                    if not elev.stops_for_later or floor <= min(elev.stops_for_later):
+                    if not elev.stops_for_later or floor <= elev.stops_for_later.min():
                         elev.stops_for_later.add(floor)
                     else:
                         elev.stops_for_after_later.add(floor)
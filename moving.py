@@ -1,6 +1,7 @@
 class MOVING:
     @staticmethod
     def handle_onboard_button_press(elev, dest_floor: int):
+        elev.building.check_served(dest_floor)
         # The below has quite a lot of repetition
         if elev.direction == "UP":
             # If destination is in the direction of movement we will stop there.
@@ -19,6 +20,7 @@ class MOVING:
 
     @staticmethod
     def handle_hallway_button_press(elev, floor, direction):
+        elev.building.check_served(floor)
         # If called from the current floor we cannot stop immediately as we're moving
         # We must see when we need to stop
         if floor == elev.current_floor:
@@ -26,12 +28,12 @@ class MOVING:
             # unless this floor would be our lowest or highest stop immediately later
             if elev.direction == direction:
                 if elev.direction == "UP":
-                    if not elev.stops_for_later or floor <= min(elev.stops_for_later):
+                    if not elev.stops_for_later or floor <= elev.stops_for_later.min():
                         elev.stops_for_later.add(floor)
                     else:
                         elev.stops_for_after_later.add(floor)
                 if elev.direction == "DOWN":
-                    if not elev.stops_for_later or floor >= max(elev.stops_for_later):
+                    if not elev.stops_for_later or floor >= elev.stops_for_later.max():
                         elev.stops_for_later.add(floor)
                     else:
                         elev.stops_for_after_later.add(floor)
@@ -44,12 +46,12 @@ class MOVING:
             # unless it can be our lowest or highest stop
             if elev.direction != direction:
                 if elev.direction == "UP":
-                    if floor >= max(elev.stops):
+                    if floor >= elev.stops.max():
                         elev.stops.add(floor)
                     else:
                         elev.stops_for_later.add(floor)
                 if elev.direction == "DOWN":
-                    if floor <= min(elev.stops):
+                    if floor <= elev.stops.min():
                         elev.stops.add(floor)
                     else:
                         elev.stops_for_later.add(floor)
@@ -66,12 +68,12 @@ class MOVING:
                     # going up
                     if elev.direction == "UP":
                         # floor is the highest of our stops. We can stop now
-                        if floor >= max(elev.stops):
+                        if floor >= elev.stops.max():
                             elev.stops.add(floor)
                         else:
                             elev.stops_for_later.add(floor)
                     if elev.direction == "DOWN":
-                        if floor <= min(elev.stops):
+                        if floor <= elev.stops.min():
                             elev.stops.add(floor)
                         else:
                             elev.stops_for_later.add(floor)
@@ -0,0 +1,233 @@
+import json
+import mmap
+import os
+import struct
+import time
+from dataclasses import dataclass
+
+from building import Building
+from elevator import (
+    DIRECTIONS,
+    MODES,
+    Elevator,
+    ElevatorEvent,
+    ElevatorState,
+    Event,
+    EventKind,
+    as_event,
+)
+
+KINDS = tuple(EventKind)
+# Not an event: a snapshot of Elevator.state to compare against on replay
+CHECKPOINT = len(KINDS)
+
+_MAGIC = b"ELEVTRC2"
+# Magic, then the length of the JSON metadata that follows. The metadata is
+# padded to a whole number of records, so records stay aligned in the file
+_HEADER = struct.Struct("<8sq")
+# kind, direction, mode (checkpoints only), floor, timestamp
+RECORD = struct.Struct("<BBBxid")
+
+
+def _metadata(elevator: Elevator) -> bytes:
+    building = elevator.building
+    metadata = json.dumps(
+        {
+            "building": {
+                "bottom_floor": building.bottom_floor,
+                "top_floor": building.top_floor,
+                "unserved": sorted(building.unserved),
+                "express_zones": building.express_zones,
+            },
+            "code": elevator.to_code(),
+        }
+    ).encode()
+    return metadata + b" " * (-(_HEADER.size + len(metadata)) % RECORD.size)
+
+
+class TraceRecorder:
+    """Append every event an elevator handles to a binary trace file
+
+    The header holds the building and the state of `elevator` (a new
+    Elevator by default) when recording starts, which is where the replay
+    starts from. Each event takes one fixed-width RECORD. Every
+    `checkpoint_every` events (and whenever `checkpoint()` is called) the
+    state of the elevator is written too, so the replay can tell where it
+    diverged.
+
+    The file is flushed every `flush_every` records, so a crash loses at most
+    that many. The record being written when it happens may be torn, and the
+    replay drops it.
+    """
+
+    def __init__(
+        self,
+        path,
+        checkpoint_every: int = 0,
+        elevator: Elevator | None = None,
+        flush_every: int = 1024,
+    ):
+        metadata = _metadata(elevator or Elevator())
+        self.file = open(path, "wb")
+        self.file.write(_HEADER.pack(_MAGIC, len(metadata)))
+        self.file.write(metadata)
+        self.file.flush()
+        self.checkpoint_every = checkpoint_every
+        self.flush_every = flush_every
+        self.events = 0
+        self._unflushed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def _write(self, record: bytes):
+        self.file.write(record)
+        self._unflushed += 1
+        if self._unflushed >= self.flush_every:
+            self.file.flush()
+            self._unflushed = 0
+
+    def record(self, event: Event | ElevatorEvent, timestamp: float | None = None):
+        event = as_event(event)
+        self._write(
+            RECORD.pack(
+                KINDS.index(event.kind),
+                DIRECTIONS.index(event.direction),
+                0,
+                event.floor or 0,
+                time.time() if timestamp is None else timestamp,
+            )
+        )
+        self.events += 1
+
+    def checkpoint(self, elevator: Elevator, timestamp: float | None = None):
+        self._write(
+            RECORD.pack(
+                CHECKPOINT,
+                DIRECTIONS.index(elevator.direction),
+                MODES.index(elevator.mode),
+                elevator.current_floor,
+                time.time() if timestamp is None else timestamp,
+            )
+        )
+
+    def handle_event(
+        self,
+        elevator: Elevator,
+        event: Event | ElevatorEvent,
+        timestamp: float | None = None,
+    ):
+        """Record an event, then have the elevator handle it
+
+        The event is recorded even if the handlers reject it, since the
+        replay has to see it rejected again.
+        """
+        self.record(event, timestamp)
+        try:
+            elevator.handle_event(event)
+        finally:
+            if self.checkpoint_every and self.events % self.checkpoint_every == 0:
+                self.checkpoint(elevator, timestamp)
+
+
+@dataclass
+class ReplayResult:
+    events: int = 0
+    rejected: int = 0
+    checkpoints: int = 0
+    seconds: float = 0.0
+    # Bytes of a torn last record, left out of the replay
+    dropped_bytes: int = 0
+
+    @property
+    def events_per_second(self) -> float:
+        return self.events / self.seconds if self.seconds else 0.0
+
+
+class TraceReplayer:
+    """Feed a trace written by TraceRecorder back through Elevator.handle_event
+
+    The file is memory mapped and decoded record by record, so traces much
+    bigger than memory are fine. A torn record at the end, from a recorder
+    that crashed mid-write, is dropped and counted in `dropped_bytes`. An
+    empty file is an empty trace.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def replay(
+        self, elevator: Elevator | None = None, check_invariants: bool = False
+    ) -> ReplayResult:
+        """Replay the trace on `elevator`, or on the one it was recorded from
+
+        Without `elevator`, the replay starts from the building and state in
+        the header. An `elevator` given has to be in the same building.
+        """
+        result = ReplayResult()
+        start = time.perf_counter()
+
+        with open(self.path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                result.seconds = time.perf_counter() - start
+                return result
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with buffer:
+            if len(buffer) < _HEADER.size:
+                raise ValueError(f"{self.path} is not an elevator trace")
+            magic, size = _HEADER.unpack_from(buffer)
+            if magic != _MAGIC:
+                raise ValueError(f"{self.path} is not an elevator trace")
+            metadata = json.loads(buffer[_HEADER.size : _HEADER.size + size])
+            building = Building(**metadata["building"])
+            if elevator is None:
+                elevator = Elevator.from_code(metadata["code"], building)
+            elif elevator.building != building:
+                raise ValueError(f"{self.path} was recorded in {building}")
+
+            records = memoryview(buffer)[_HEADER.size + size :]
+            result.dropped_bytes = len(records) % RECORD.size
+            whole = records[: len(records) - result.dropped_bytes]
+            try:
+                for n, (kind, direction, mode, floor, _) in enumerate(
+                    RECORD.iter_unpack(whole)
+                ):
+                    if kind == CHECKPOINT:
+                        expected = ElevatorState(
+                            mode=MODES[mode].__name__,
+                            direction=DIRECTIONS[direction],
+                            current_floor=floor,
+                            building=elevator.building,
+                        )
+                        assert elevator.state == expected, (
+                            f"Replay diverged at record {n}: "
+                            f"{elevator.state} != {expected}"
+                        )
+                        result.checkpoints += 1
+                        continue
+                    # A new Event per record, since whatever handles it may
+                    # keep it around
+                    if KINDS[kind] == EventKind.LOADING_COMPLETE:
+                        event = Event(EventKind.LOADING_COMPLETE)
+                    else:
+                        event = Event(KINDS[kind], floor, DIRECTIONS[direction])
+                    try:
+                        elevator.handle_event(event)
+                    except RuntimeError:
+                        result.rejected += 1
+                    result.events += 1
+                    if check_invariants:
+                        elevator.invariants()
+            finally:
+                # The mmap can't be closed while a view into it is alive
+                whole.release()
+                records.release()
+
+        result.seconds = time.perf_counter() - start
+        return result
@@ -0,0 +1,175 @@
+import asyncio
+import contextlib
+import time
+from dataclasses import dataclass, field
+
+from elevator import Elevator, ElevatorEvent, Event, EventKind, as_event
+from invariants import InvariantEngine
+from modes import IDLE
+
+# Events from the car's own hardware. They are what moves the state machine
+# along, so they jump the queue and are never dropped
+PRIORITY_KINDS = ("FLOOR_SENSOR", "LOADING_COMPLETE")
+
+
+def is_redundant_press(elev: Elevator, event: Event) -> bool:
+    """Whether handling a button press would leave the elevator as it is
+
+    That is the case for a press for a floor that is already one of the stops
+    on the way, in the direction the car is going. Anything else (a press at
+    the current floor, against the direction of travel...) may still change
+    something, so it isn't redundant.
+    """
+    if elev.mode == IDLE or elev.direction is None:
+        return False
+    if event.kind == EventKind.HALLWAY_BUTTON_PRESS:
+        if event.direction != elev.direction:
+            return False
+    elif event.kind != EventKind.ONBOARD_PANEL_BUTTON_PRESS:
+        return False
+    floor = event.floor
+    if elev.direction == "UP":
+        on_the_way = floor > elev.current_floor
+    else:
+        on_the_way = floor < elev.current_floor
+    return on_the_way and floor in elev.stops
+
+
+@dataclass
+class LatencyStats:
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+@dataclass
+class RuntimeMetrics:
+    handled: int = 0
+    coalesced: int = 0
+    rejected: int = 0
+    queue_depth: int = 0
+    max_queue_depth: int = 0
+    # Time from submit() until the handler returned, per kind of event
+    latency: dict[str, LatencyStats] = field(
+        default_factory=lambda: {"priority": LatencyStats(), "press": LatencyStats()}
+    )
+
+
+class ControllerRuntime:
+    """Feed an Elevator from any number of async event sources
+
+    Sensor and loading complete events go through their own queue, which is
+    always drained first. Button presses go through a bounded queue: when it
+    is full `submit()` blocks, pushing back on whoever is mashing the buttons.
+    Presses that are already queued, or that wouldn't change anything because
+    their floor is already a stop on the way, are dropped (coalesced) both when
+    they are submitted and again right before they are handled.
+
+    Events the handlers reject are counted in `metrics.rejected`, and the
+    runtime carries on with the next one. With an InvariantEngine, events are
+    handled through it and violations pile up in its `violations`.
+    """
+
+    def __init__(
+        self,
+        elevator: Elevator | None = None,
+        max_pending_presses=64,
+        invariants: InvariantEngine | None = None,
+    ):
+        self.elevator = elevator or Elevator()
+        self.invariants = invariants
+        self.metrics = RuntimeMetrics()
+        self.last_error: Exception | None = None
+        self._priority = asyncio.Queue()
+        self._presses = asyncio.Queue(maxsize=max_pending_presses)
+        self._queued_presses = set()
+        self._ready = asyncio.Event()
+
+    def _update_depth(self):
+        depth = self._priority.qsize() + self._presses.qsize()
+        self.metrics.queue_depth = depth
+        if depth > self.metrics.max_queue_depth:
+            self.metrics.max_queue_depth = depth
+
+    async def submit(self, event: Event | ElevatorEvent):
+        event = as_event(event)
+        submitted = time.perf_counter()
+        if event.kind in PRIORITY_KINDS:
+            self._priority.put_nowait((submitted, event))
+        else:
+            if event in self._queued_presses or is_redundant_press(
+                self.elevator, event
+            ):
+                self.metrics.coalesced += 1
+                return
+            self._queued_presses.add(event)
+            await self._presses.put((submitted, event))
+        self._update_depth()
+        self._ready.set()
+
+    async def run_source(self, source):
+        async for event in source:
+            await self.submit(event)
+
+    async def _next(self) -> tuple[asyncio.Queue, float, Event]:
+        while True:
+            for queue in (self._priority, self._presses):
+                if not queue.empty():
+                    submitted, event = queue.get_nowait()
+                    return queue, submitted, event
+            self._ready.clear()
+            await self._ready.wait()
+
+    async def _consume(self):
+        while True:
+            queue, submitted, event = await self._next()
+            if queue is self._presses:
+                self._queued_presses.discard(event)
+            self._update_depth()
+            if queue is self._presses and is_redundant_press(self.elevator, event):
+                self.metrics.coalesced += 1
+            else:
+                try:
+                    if self.invariants is None:
+                        self.elevator.handle_event(event)
+                    else:
+                        self.invariants.handle_event(self.elevator, event)
+                    self.metrics.handled += 1
+                except RuntimeError as e:
+                    self.metrics.rejected += 1
+                    self.last_error = e
+                latency = time.perf_counter() - submitted
+                kind = "press" if queue is self._presses else "priority"
+                self.metrics.latency[kind].add(latency)
+            queue.task_done()
+            # Let the sources run between events, so a burst of presses
+            # can't starve them
+            await asyncio.sleep(0)
+
+    async def join(self):
+        """Wait until everything submitted so far has been handled"""
+        # Every get() is matched by a task_done(), so join() also waits for
+        # the event being handled right now, which qsize() doesn't count
+        await self._priority.join()
+        await self._presses.join()
+
+    async def run(self, *sources):
+        """Handle events from `sources` (async iterables) until all run dry"""
+        consumer = asyncio.create_task(self._consume())
+        try:
+            await asyncio.gather(*(self.run_source(source) for source in sources))
+            await self.join()
+        finally:
+            consumer.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await consumer
@@ -0,0 +1,300 @@
+import heapq
+import random
+import statistics
+import time
+from dataclasses import dataclass, field
+
+from building import DEFAULT_BUILDING, Building
+from elevator import Elevator, ElevatorEvent
+from modes import IDLE, LOADING, MOVING
+
+
+@dataclass
+class Passenger:
+    origin: int
+    dest: int
+    arrival_time: float
+    board_time: float | None = None
+    exit_time: float | None = None
+
+    @property
+    def direction(self) -> str:
+        return "UP" if self.dest > self.origin else "DOWN"
+
+
+class PoissonArrivals:
+    """Passengers showing up at `rate` per second, between uniformly random floors
+
+    Only floors the building serves are picked.
+    """
+
+    def __init__(self, rate: float, seed=None, building: Building = DEFAULT_BUILDING):
+        self.rate = rate
+        self.rng = random.Random(seed)
+        self.floors = sorted(building.served)
+
+    def _trip(self) -> tuple[int, int]:
+        origin, dest = self.rng.sample(self.floors, 2)
+        return origin, dest
+
+    def __iter__(self):
+        now = 0.0
+        while True:
+            now += self.rng.expovariate(self.rate)
+            origin, dest = self._trip()
+            yield Passenger(origin=origin, dest=dest, arrival_time=now)
+
+
+class UpPeakArrivals(PoissonArrivals):
+    """Morning rush: most passengers come in at the lobby and go up
+
+    `lobby_share` of the passengers start on the lowest floor served, the rest
+    travel between random floors like PoissonArrivals.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        lobby_share: float = 0.85,
+        seed=None,
+        building: Building = DEFAULT_BUILDING,
+    ):
+        super().__init__(rate, seed=seed, building=building)
+        self.lobby_share = lobby_share
+
+    def _trip(self) -> tuple[int, int]:
+        if self.rng.random() < self.lobby_share:
+            lobby = self.floors[0]
+            return lobby, self.rng.choice(self.floors[1:])
+        return super()._trip()
+
+
+def _distribution(values: list[float]) -> dict:
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+
+    def percentile(p):
+        return values[min(len(values) - 1, int(p * len(values)))]
+
+    return {
+        "count": len(values),
+        "mean": statistics.fmean(values),
+        "p50": percentile(0.5),
+        "p90": percentile(0.9),
+        "p99": percentile(0.99),
+        "max": values[-1],
+    }
+
+
+@dataclass
+class SimulationReport:
+    simulated_seconds: float
+    wall_seconds: float
+    events: int
+    passengers: list[Passenger] = field(repr=False)
+    # Why the simulation stopped early, if it did
+    fault: str | None = None
+
+    @property
+    def delivered(self) -> list[Passenger]:
+        return [p for p in self.passengers if p.exit_time is not None]
+
+    def summary(self) -> dict:
+        delivered = self.delivered
+        return {
+            "simulated_seconds": self.simulated_seconds,
+            "fault": self.fault,
+            "wall_seconds": self.wall_seconds,
+            "events": self.events,
+            "arrived": len(self.passengers),
+            "delivered": len(delivered),
+            "throughput_per_hour": (
+                len(delivered) * 3600 / self.simulated_seconds
+                if self.simulated_seconds
+                else 0.0
+            ),
+            "wait_time": _distribution(
+                [p.board_time - p.arrival_time for p in delivered]
+            ),
+            "ride_time": _distribution([p.exit_time - p.board_time for p in delivered]),
+        }
+
+
+class Simulation:
+    """Discrete-event simulation of an Elevator and the people using it
+
+    Everything happens on a simulated clock driven by a heap of timed events:
+    passenger arrivals, floor sensors (`travel_time` seconds after the car
+    starts moving or passes a floor) and loading complete (`door_time` seconds
+    after the doors open). The car itself is driven by the real mode handlers,
+    the simulation only decides when the events reach it.
+
+    Passengers press the hallway button when they arrive, board when the doors
+    open on their floor and the car is going their way (or has no direction),
+    and press their destination once inside. Presses the handlers ignore are
+    repeated whenever the doors close, as people tend to do.
+
+    If the controller misbehaves (a handler rejects an event, the car tries to
+    leave the building, or an invariant breaks with `check_invariants`) the
+    run stops there and the report says why.
+    """
+
+    def __init__(
+        self,
+        arrivals,
+        elevator: Elevator | None = None,
+        travel_time: float = 2.0,
+        door_time: float = 10.0,
+        check_invariants: bool = False,
+    ):
+        self.elevator = elevator or Elevator()
+        self.arrivals = iter(arrivals)
+        self.travel_time = travel_time
+        self.door_time = door_time
+        self.check_invariants = check_invariants
+
+        self.now = 0.0
+        self.timers = []
+        self._sequence = 0
+        self._sensor_pending = False
+        self._doors_pending = False
+
+        self.passengers = []
+        self.waiting = {}
+        self.riding = []
+        self.events = 0
+
+    def _schedule(self, at: float, kind: str, data=None):
+        # The sequence number keeps ties in insertion order, and stops heapq
+        # from ever comparing the data
+        heapq.heappush(self.timers, (at, self._sequence, kind, data))
+        self._sequence += 1
+
+    def _send(self, event: ElevatorEvent, after_event: bool = True):
+        self.elevator.handle_event(event)
+        self.events += 1
+        if self.check_invariants:
+            self.elevator.invariants()
+        if after_event:
+            self._after_event()
+
+    def _after_event(self):
+        elev = self.elevator
+        if elev.mode == LOADING:
+            self._exchange_passengers()
+            if not self._doors_pending:
+                self._doors_pending = True
+                self._schedule(self.now + self.door_time, "LOADING_COMPLETE")
+        elif elev.mode == MOVING and not self._sensor_pending:
+            next_floor = elev.current_floor + (1 if elev.direction == "UP" else -1)
+            if next_floor not in elev.building.floors:
+                raise RuntimeError(f"Elevator trying to leave the building: {elev!r}")
+            self._sensor_pending = True
+            self._schedule(self.now + self.travel_time, "FLOOR_SENSOR", next_floor)
+
+    def _exchange_passengers(self):
+        elev = self.elevator
+        floor = elev.current_floor
+        still_riding = []
+        for passenger in self.riding:
+            if passenger.dest == floor:
+                passenger.exit_time = self.now
+            else:
+                still_riding.append(passenger)
+        self.riding = still_riding
+
+        boarding = []
+        still_waiting = []
+        for passenger in self.waiting.get(floor, ()):
+            if elev.direction in (None, passenger.direction):
+                passenger.board_time = self.now
+                boarding.append(passenger)
+            else:
+                still_waiting.append(passenger)
+        self.waiting[floor] = still_waiting
+        self.riding.extend(boarding)
+        # Pressing the buttons can't close the doors, so there's no need to
+        # exchange passengers again after each one
+        for passenger in boarding:
+            self._press_onboard(passenger)
+
+    def _press_onboard(self, passenger: Passenger):
+        self._send(
+            ElevatorEvent(
+                kind="ONBOARD_PANEL_BUTTON_PRESS", payload={"dest": passenger.dest}
+            ),
+            after_event=False,
+        )
+
+    def _press_hallway(self, passenger: Passenger):
+        self._send(
+            ElevatorEvent(
+                kind="HALLWAY_BUTTON_PRESS",
+                payload={"floor": passenger.origin, "direction": passenger.direction},
+            )
+        )
+
+    def _pending_floors(self) -> set:
+        elev = self.elevator
+        return set(elev.stops) | set(elev.stops_for_later) | set(
+            elev.stops_for_after_later
+        )
+
+    def _press_forgotten_buttons(self):
+        pending = self._pending_floors()
+        for passenger in self.riding:
+            if passenger.dest not in pending:
+                self._press_onboard(passenger)
+                self._after_event()
+                pending = self._pending_floors()
+        for floor, passengers in self.waiting.items():
+            if passengers and floor not in pending:
+                self._press_hallway(passengers[0])
+                pending = self._pending_floors()
+
+    def _next_arrival(self):
+        passenger = next(self.arrivals, None)
+        if passenger is not None:
+            self._schedule(passenger.arrival_time, "ARRIVAL", passenger)
+
+    def run(self, until: float) -> SimulationReport:
+        start = time.perf_counter()
+        fault = None
+        self._next_arrival()
+        while self.timers and self.timers[0][0] <= until:
+            self.now, _, kind, data = heapq.heappop(self.timers)
+            try:
+                self._handle_timer(kind, data)
+            except (RuntimeError, AssertionError) as e:
+                fault = f"t={self.now:.1f}: {e}"
+                until = self.now
+                break
+        return SimulationReport(
+            simulated_seconds=until,
+            wall_seconds=time.perf_counter() - start,
+            events=self.events,
+            passengers=self.passengers,
+            fault=fault,
+        )
+
+    def _handle_timer(self, kind: str, data):
+        if kind == "ARRIVAL":
+            self.passengers.append(data)
+            self.waiting.setdefault(data.origin, []).append(data)
+            self._press_hallway(data)
+            self._next_arrival()
+        elif kind == "FLOOR_SENSOR":
+            self._sensor_pending = False
+            self._send(ElevatorEvent(kind="FLOOR_SENSOR", payload={"floor": data}))
+        elif kind == "LOADING_COMPLETE":
+            self._doors_pending = False
+            self._send(ElevatorEvent(kind="LOADING_COMPLETE"))
+            if self.elevator.mode in (IDLE, MOVING):
+                self._press_forgotten_buttons()
+
+
+if __name__ == "__main__":
+    # A building-day of morning up-peak traffic
+    simulation = Simulation(UpPeakArrivals(rate=1 / 60, seed=0))
+    print(simulation.run(until=24 * 3600).summary())
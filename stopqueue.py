@@ -0,0 +1,110 @@
+class StopQueue:
+    """A set of floors stored as a bitmask
+
+    Bit i of `mask` stands for floor `offset + i`. Membership, insertion,
+    removal, `min()` and `max()` are all a handful of int operations no matter
+    how tall the building is. It quacks like a set of ints (iteration, `in`,
+    `len`, comparison with sets...) so code written against the old `set`
+    attributes of the Elevator keeps working.
+
+    With a `size`, only the floors `offset` to `offset + size - 1` can be
+    added. Without one there's no top floor.
+    """
+
+    __slots__ = ("mask", "offset", "size")
+
+    def __init__(self, floors=(), offset: int = 0, size: int | None = None):
+        self.mask = 0
+        self.offset = offset
+        self.size = size
+        for floor in floors:
+            self.add(floor)
+
+    @classmethod
+    def from_mask(
+        cls, mask: int, offset: int = 0, size: int | None = None
+    ) -> "StopQueue":
+        queue = cls(offset=offset, size=size)
+        queue.mask = mask
+        return queue
+
+    def copy(self) -> "StopQueue":
+        return StopQueue.from_mask(self.mask, self.offset, self.size)
+
+    def add(self, floor: int):
+        shift = floor - self.offset
+        if shift < 0 or self.size is not None and shift >= self.size:
+            if self.size is None:
+                floors = f"start at {self.offset}"
+            else:
+                floors = f"are {self.offset} to {self.offset + self.size - 1}"
+            raise ValueError(f"Can't stop at floor {floor}, the floors {floors}")
+        self.mask |= 1 << shift
+
+    def discard(self, floor: int):
+        if floor >= self.offset:
+            self.mask &= ~(1 << (floor - self.offset))
+
+    def clear(self):
+        self.mask = 0
+
+    def min(self) -> int:
+        if not self.mask:
+            raise ValueError("min() of an empty StopQueue")
+        return (self.mask & -self.mask).bit_length() - 1 + self.offset
+
+    def max(self) -> int:
+        if not self.mask:
+            raise ValueError("max() of an empty StopQueue")
+        return self.mask.bit_length() - 1 + self.offset
+
+    def intersection(self, other) -> "StopQueue":
+        return StopQueue.from_mask(
+            self.mask & self._mask_of(other), self.offset, self.size
+        )
+
+    __and__ = intersection
+
+    def union(self, other) -> "StopQueue":
+        return StopQueue.from_mask(
+            self.mask | self._mask_of(other), self.offset, self.size
+        )
+
+    __or__ = union
+
+    def _mask_of(self, other) -> int:
+        if isinstance(other, StopQueue) and other.offset == self.offset:
+            return other.mask
+        return StopQueue(other, self.offset, self.size).mask
+
+    def __contains__(self, floor) -> bool:
+        if not isinstance(floor, int) or floor < self.offset:
+            return False
+        return bool(self.mask >> (floor - self.offset) & 1)
+
+    def __iter__(self):
+        mask = self.mask
+        while mask:
+            low_bit = mask & -mask
+            yield low_bit.bit_length() - 1 + self.offset
+            mask ^= low_bit
+
+    def __len__(self) -> int:
+        return self.mask.bit_count()
+
+    def __bool__(self) -> bool:
+        return bool(self.mask)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, StopQueue):
+            if other.offset == self.offset:
+                return self.mask == other.mask
+            return set(self) == set(other)
+        if isinstance(other, (set, frozenset)):
+            return set(self) == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"StopQueue({set(self)})"
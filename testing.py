@@ -1,73 +1,393 @@
-from itertools import product
+import argparse
 import copy
+import random
+import tempfile
+from pathlib import Path
 from dataclasses import dataclass
 from typing import Literal, Any
 
-from elevator import ElevatorEvent, Elevator, ElevatorState
-from modes import IDLE, MOVING, LOADING
+from building import DEFAULT_BUILDING, Building
+from cache import TransitionCache
+from elevator import (
+    ElevatorEvent,
+    Elevator,
+    ElevatorState,
+    Event,
+    EventKind,
+    as_event,
+)
+from explorer import CounterexampleFound, Explorer
+from modes import MOVING
+from stopqueue import StopQueue
+
+# Small enough for the checks below to go through every full state
+SMALL_BUILDING = Building(bottom_floor=1, top_floor=3)
 
 
-floors = range(Elevator.BOTTOM_FLOOR, Elevator.TOP_FLOOR + 1)
-directions = ["UP", "DOWN"]
 #
 # # This one can only happen when the elevator is loading
 # loading_complete_event = ElevatorEvent(kind="LOADING_COMPLETE")
 
 
-def get_possible_events(state: ElevatorState) -> list[ElevatorEvent]:
-    possible_events = []
+def get_possible_events(state: ElevatorState) -> tuple[Event, ...]:
+    # The events only depend on the state and its building, which has them
+    # worked out already
+    return state.building.possible_events(state)
+
+
+def event_key(event: Event | ElevatorEvent) -> tuple:
+    """A tuple that is the same for equivalent Events and ElevatorEvents"""
+    event = as_event(event)
+    return (event.kind, event.floor, event.direction)
+
+
+def get_all_events(building: Building = DEFAULT_BUILDING) -> list[Event]:
+    """Every event that get_possible_events can return, in a fixed order"""
+    return list(building.all_events)
+
+
+def evolve_elevator(
+    elevator: Elevator,
+    visited_states: set,
+    processes: int = 1,
+    transition_cache: TransitionCache | None = None,
+):
+    explorer = Explorer(
+        get_possible_events, processes=processes, transition_cache=transition_cache
+    )
+    try:
+        visited_states |= explorer.explore(elevator)
+    except CounterexampleFound as e:
+        print(f"Invariant broken: {e}")
+        print(e.script)
+        raise
+    print(explorer.stats)
+    return visited_states
+
+
+def check_full_state(building: Building = DEFAULT_BUILDING):
+    """Explore every full state, reusing what the cache knows"""
+    from incremental import explore_cached
+
+    exploration = explore_cached(Elevator(building=building))
+    print(exploration.stats)
+    counts = {}
+    for state_id in range(len(exploration)):
+        message = exploration.violation(state_id)
+        if message is not None:
+            counts[message] = counts.get(message, 0) + 1
+    for message, count in sorted(counts.items()):
+        print(f"{count} states: {message}")
+    return exploration
+
+
+def _full_state(elevator: Elevator) -> tuple:
+    # Like to_code(), but also for cars that went through the roof or floor
+    return (
+        elevator.state,
+        elevator.stops.mask,
+        elevator.stops_for_later.mask,
+        elevator.stops_for_after_later.mask,
+    )
 
-    # Let's start with the events that can happen regardless of the elevator state: button presses
-    button_presses = []
-    for dest in floors:
-        payload = {"dest": dest}
-        button_presses.append(
-            ElevatorEvent(kind="ONBOARD_PANEL_BUTTON_PRESS", payload=payload)
+
+def _handled_state(elevator: Elevator, event) -> tuple | None:
+    try:
+        elevator.handle_event(event)
+    except RuntimeError:
+        return None
+    return _full_state(elevator)
+
+
+def check_code_round_trip(building: Building = SMALL_BUILDING):
+    """Every full state survives to_code() and from_code()
+
+    And from each of them, every possible event steps the elevator to the
+    same state whether it is an Event or an ElevatorEvent.
+    """
+    explorer = Explorer(get_possible_events, full_state=True, stop_on_violation=False)
+    codes = explorer.explore(Elevator(building=building))
+    for code in codes:
+        elevator = Elevator.from_code(code, building)
+        assert elevator.to_code() == code, f"State {code} doesn't round trip"
+        for event in get_possible_events(elevator.state):
+            elevator_event = ElevatorEvent(EventKind(event.kind).value, event.payload)
+            expected = _handled_state(Elevator.from_code(code, building), event)
+            actual = _handled_state(Elevator.from_code(code, building), elevator_event)
+            assert actual == expected, (
+                f"{elevator_event} and {event} disagree from state {code}: "
+                f"{actual} != {expected}"
+            )
+    print(f"{len(codes)} full states round trip through their codes")
+
+
+def check_stop_queue(
+    buildings=(Building(bottom_floor=-2, top_floor=3), Building(top_floor=64)),
+    operations: int = 2000,
+    seed=0,
+):
+    """StopQueues behave like sets of the floors of any building"""
+    rng = random.Random(seed)
+    for building in buildings:
+        offset, size = building.bottom_floor, building.n_floors
+        queue, expected = StopQueue(offset=offset, size=size), set()
+        for _ in range(operations):
+            floor = rng.choice(building.floors)
+            if rng.random() < 0.6:
+                queue.add(floor)
+                expected.add(floor)
+            else:
+                queue.discard(floor)
+                expected.discard(floor)
+            other = set(rng.sample(building.floors, 3))
+            assert queue == expected and len(queue) == len(expected)
+            assert list(queue) == sorted(expected)
+            assert (floor in queue) == (floor in expected)
+            assert queue | other == expected | other
+            assert queue & other == expected & other
+            if expected:
+                assert (queue.min(), queue.max()) == (min(expected), max(expected))
+            assert StopQueue.from_mask(queue.mask, offset, size) == queue.copy()
+        for floor in (offset - 1, offset + size):
+            try:
+                queue.add(floor)
+            except ValueError:
+                continue
+            raise AssertionError(f"Floor {floor} is outside {building}")
+    print("Stop queues behave like sets")
+
+
+def check_fleet(
+    building: Building = DEFAULT_BUILDING, cars: int = 20, steps: int = 5000, seed=0
+):
+    """Cars of a Fleet step exactly like the Elevators they were made from"""
+    from fleet import Fleet
+
+    rng = random.Random(seed)
+    elevators = [Elevator(building=building) for _ in range(cars)]
+    fleet = Fleet.from_elevators(elevators)
+
+    def assert_same(car: int):
+        elevator, view = elevators[car], fleet[car]
+        assert _full_state(view) == _full_state(elevator), f"{view!r} != {elevator!r}"
+        assert (
+            view.motor_controller.motor_state == elevator.motor_controller.motor_state
         )
-    for direction, floor in product(directions, floors):
-        if floor == 1 and direction == "DOWN":
+
+    for step in range(steps):
+        if step % 10 == 0:
+            # Every moving car that stays in the building reaches its next floor
+            moving = {}
+            for car, elevator in enumerate(elevators):
+                if elevator.mode == MOVING:
+                    floor = elevator.current_floor + (
+                        1 if elevator.direction == "UP" else -1
+                    )
+                    if floor in building.floors:
+                        moving[car] = floor
+            fleet.apply_floor_sensors(moving)
+            for car, floor in moving.items():
+                elevators[car].handle_event(Event(EventKind.FLOOR_SENSOR, floor))
+                assert_same(car)
             continue
-        if floor == 5 and direction == "UP":
+        car = rng.randrange(cars)
+        event = rng.choice(get_possible_events(elevators[car].state))
+        expected = _handled_state(elevators[car], event)
+        assert _handled_state(fleet[car], event) == expected
+        assert_same(car)
+
+    snapshot = fleet.snapshot()
+    fleet.handle_events((car, building.button_presses[-1]) for car in range(cars))
+    fleet.restore(snapshot)
+    for car in range(cars):
+        assert_same(car)
+    print(f"A fleet of {cars} cars steps like {cars} elevators")
+
+
+def _first_violation(elevator: Elevator) -> str | None:
+    try:
+        elevator.invariants()
+    except AssertionError as e:
+        return str(e)
+    return None
+
+
+def check_invariant_engine(building: Building = SMALL_BUILDING):
+    """With every tier on, the InvariantEngine agrees with Elevator.invariants()
+
+    On every full state, and after every event handled from a valid one,
+    where it only looks at the invariants of the fields that changed.
+    """
+    from invariants import InvariantEngine
+
+    explorer = Explorer(get_possible_events, full_state=True, stop_on_violation=False)
+    codes = explorer.explore(Elevator(building=building))
+    engine = InvariantEngine(debug=True)
+    checked = 0
+
+    def assert_agree(elevator: Elevator, violations: list):
+        expected = _first_violation(elevator)
+        names = {violation.invariant for violation in violations}
+        assert (expected is None) == (not names) and (
+            expected is None or expected in names
+        ), f"{elevator!r}: the engine found {names}, invariants() {expected}"
+
+    for code in codes:
+        elevator = Elevator.from_code(code, building)
+        assert_agree(elevator, engine.check(elevator))
+        checked += 1
+        if _first_violation(elevator) is not None:
             continue
-        button_presses.append(
-            ElevatorEvent(
-                kind="HALLWAY_BUTTON_PRESS",
-                payload={"floor": floor, "direction": direction},
+        for event in get_possible_events(elevator.state):
+            elevator = Elevator.from_code(code, building)
+            try:
+                violations = engine.handle_event(elevator, event)
+            except RuntimeError:
+                continue
+            assert_agree(elevator, violations)
+            checked += 1
+    print(f"InvariantEngine agrees with invariants() on {checked} states")
+
+
+def check_transition_cache(building: Building = SMALL_BUILDING):
+    """Exploring again through a warm TransitionCache finds the same states
+
+    Every edge of the second exploration is a hit, and every entry still
+    agrees with the handlers.
+    """
+    cache = TransitionCache(building)
+    explorer = Explorer(
+        get_possible_events,
+        full_state=True,
+        stop_on_violation=False,
+        transition_cache=cache,
+    )
+    root = Elevator(building=building)
+    codes = explorer.explore(root)
+    hits = cache.stats.hits
+    assert explorer.explore(root) == codes
+    assert cache.stats.hits - hits == explorer.stats.edges, cache.stats
+    cache.verify()
+    print(f"Transition cache of {len(cache)} entries agrees with the handlers")
+
+
+def check_incremental(building: Building = SMALL_BUILDING):
+    """An exploration updated after a handler changed is a fresh exploration
+
+    The stored exploration is made to look as if the IDLE handlers were
+    edited since, so `explore_cached()` has to run them again and reuse the
+    rest.
+    """
+    from incremental import StoredExploration, explore_cached
+
+    root = Elevator(building=building)
+    explorer = Explorer(
+        get_possible_events, full_state=True, stop_on_violation=False, keep_graph=True
+    )
+    explorer.explore(root)
+    graph = explorer.graph
+    expected = (
+        {
+            (graph.keys[source], graph.events[event_id], graph.keys[target])
+            for source in range(len(graph))
+            for target, event_id in graph.edges(source)
+        },
+        {key for key, violating in zip(graph.keys, graph.violating) if violating},
+    )
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        explore_cached(root, cache_dir).close()
+        (path,) = Path(cache_dir).glob("exploration-*.bin")
+        with StoredExploration.load(path, building) as stored:
+            stored.handlers = {
+                key: "edited" if key.startswith("IDLE.") else fingerprint
+                for key, fingerprint in stored.handlers.items()
+            }
+            stored.save(path)
+        with explore_cached(root, cache_dir) as updated:
+            events = building.all_events
+            actual = (
+                {
+                    (updated.codes[source], events[event_id], updated.codes[target])
+                    for source in range(len(updated))
+                    for target, event_id in updated.edges(source)
+                },
+                {
+                    code
+                    for code, verdict in zip(updated.codes, updated.verdicts)
+                    if verdict
+                },
             )
+            stats = updated.stats
+    assert stats.source == "updated" and 0 < stats.handled < stats.edges, stats
+    assert len(updated) == len(graph) and actual == expected
+    print(f"Updated exploration of {len(graph)} states matches a fresh one")
+
+
+def check_compiled(building: Building = SMALL_BUILDING):
+    """The compiled transition table agrees with the handlers"""
+    from compiled import TransitionTable
+
+    table = TransitionTable.compile(Elevator(building=building))
+    table.verify(samples=len(table.codes) * table.n_events, seed=0)
+    print(f"Transition table of {len(table.codes)} states agrees with the handlers")
+
+
+def check_liveness(building: Building = Building(bottom_floor=-1, top_floor=2)):
+    """Starvation is found the same way whatever floor a building starts at
+
+    `building` is compared with the same building moved up to start at 1.
+    """
+    from liveness import find_starvation, waiting_states
+
+    shift = 1 - building.bottom_floor
+    shifted = Building(bottom_floor=1, top_floor=building.top_floor + shift)
+    results = []
+    for b in (building, shifted):
+        explorer = Explorer(
+            get_possible_events,
+            full_state=True,
+            stop_on_violation=False,
+            keep_graph=True,
         )
-    possible_events.extend(button_presses)
-
-    if state.mode == "IDLE":
-        pass
-    elif state.mode == "LOADING":
-        possible_events.append(ElevatorEvent(kind="LOADING_COMPLETE"))
-    elif state.mode == "MOVING":
-        if state.direction == "UP":
-            payload = {"floor": state.current_floor + 1}
-        if state.direction == "DOWN":
-            payload = {"floor": state.current_floor - 1}
-        possible_events.append(ElevatorEvent(kind="FLOOR_SENSOR", payload=payload))
-    return possible_events
-
-
-def evolve_elevator(elevator: Elevator, visited_states: set):
-    for event in get_possible_events(elevator.state):
-        new_elevator = elevator.copy()
-        new_elevator.handle_event(event)
-        new_elevator.invariants()
-        new_state = new_elevator.state
-        if new_state not in visited_states:
-            visited_states.add(new_state)
-            evolve_elevator(new_elevator, visited_states)
-    return visited_states
+        explorer.explore(Elevator(building=b))
+        waiting = {
+            floor - b.bottom_floor: sum(states)
+            for floor, states in waiting_states(explorer.graph).items()
+        }
+        starved = [
+            (starvation.floor - b.bottom_floor, starvation.states)
+            for starvation in find_starvation(explorer.graph)
+        ]
+        results.append((waiting, starved))
+    assert results[0] == results[1], f"{building} and {shifted} disagree: {results}"
+    print(f"Liveness agrees between floors {building.floors} and {shifted.floors}")
 
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Explore the elevator's states")
+    parser.add_argument(
+        "--full-state",
+        action="store_true",
+        help="Explore every full state (stops included), through the cache",
+    )
+    if parser.parse_args().full_state:
+        check_full_state()
+    else:
+        elevator = Elevator()
+        visited_states = {elevator.state}
 
-elevator = Elevator()
-elevators = [elevator]
-visited_states = {elevator.state}
+        visited_states = evolve_elevator(elevator, visited_states)
 
-visted_states = evolve_elevator(elevator, visited_states)
+        for s in sorted(visited_states, key=lambda x: (x.mode, x.current_floor)):
+            print(s)
 
-for s in sorted(visited_states, key=lambda x: (x.mode, x.current_floor)):
-    print(s)
+        check_code_round_trip()
+        check_code_round_trip(Building(bottom_floor=-1, top_floor=1))
+        check_stop_queue()
+        check_invariant_engine()
+        check_transition_cache()
+        check_incremental()
+        check_compiled()
+        check_fleet()
+        check_liveness()